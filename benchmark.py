@@ -0,0 +1,386 @@
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+from bisect import bisect_left
+from multiprocessing import Process, Pipe
+
+import search
+import typeahead_search_with_TRIE
+
+TYPES = ['user','topic','question','board']
+
+class Workload(object):
+    '''The parameters of a benchmark run. The same parameters, seed
+       included, always give the same commands.
+
+       Attributes:
+         corpusSize: the number of items ADDed before the timed commands
+         numOfCommands: the number of timed commands
+         mix: maps ADD, DEL, QUERY and WQUERY to their share of the timed
+         commands
+         vocabulary: 'story' for the words of make_input, or 'synthetic'
+         for vocabularySize random words
+         vocabularySize: the number of synthetic words
+         distribution: 'zipf' or 'uniform', how often each word is drawn
+         zipfExponent: the exponent of the zipf distribution
+         minWords, maxWords: the range of the number of words of an item
+         maxTokens: the most tokens of a query
+         numOfResults: the number of results of every query
+         seed: seeds every random choice
+    '''
+    def __init__(self, corpusSize=5000, numOfCommands=2000,
+                 mix=None, vocabulary='story', vocabularySize=2000,
+                 distribution='zipf', zipfExponent=1.1, minWords=5,
+                 maxWords=20, maxTokens=3, numOfResults=10, seed=0):
+        self.corpusSize = corpusSize
+        self.numOfCommands = numOfCommands
+        if mix is None:
+            mix = {'ADD': 0.1, 'DEL': 0.05, 'QUERY': 0.6, 'WQUERY': 0.25}
+        self.mix = mix
+        self.vocabulary = vocabulary
+        self.vocabularySize = vocabularySize
+        self.distribution = distribution
+        self.zipfExponent = zipfExponent
+        self.minWords = minWords
+        self.maxWords = maxWords
+        self.maxTokens = maxTokens
+        self.numOfResults = numOfResults
+        self.seed = seed
+
+    def params(self):
+        return dict(self.__dict__)
+
+    def words(self):
+        '''the vocabulary, most frequent first'''
+        if self.vocabulary == 'story':
+            #make_input draws from the global random, so it is seeded too
+            random.seed(self.seed)
+            counts = {}
+            for line in search.make_input().split("\n")[1:-1]:
+                if not line.startswith('ADD'):
+                    continue
+                for word in line.split(" ", 4)[4].lower().split():
+                    counts[word] = counts.get(word, 0) + 1
+            return sorted(counts, key=lambda word: (-counts[word], word))
+        rnd = random.Random(self.seed)
+        words = set()
+        while len(words) < self.vocabularySize:
+            words.add("".join([chr(rnd.randint(97, 122))
+                               for _ in range(rnd.randint(2, 10))]))
+        return sorted(words)
+
+    def commands(self):
+        '''returns the (command, command data) pairs of the corpus ADDs
+           and of the timed commands'''
+        rnd = random.Random(self.seed)
+        words = self.words()
+        if self.distribution == 'zipf':
+            weights = [1.0 / (rank + 1) ** self.zipfExponent
+                       for rank in range(len(words))]
+        else:
+            weights = [1.0] * len(words)
+        cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+
+        def word():
+            return words[bisect_left(cumulative, rnd.random() * total)]
+
+        live = []
+        nextID = [0]
+
+        def add():
+            type_ = rnd.choice(TYPES)
+            id_ = '%s%d' % (type_[0], nextID[0])
+            nextID[0] += 1
+            live.append(id_)
+            dataStr = " ".join([word() for _ in
+                                range(rnd.randint(self.minWords,
+                                                  self.maxWords))])
+            return ('ADD', '%s %s %.1f %s' % (type_, id_,
+                                              rnd.randrange(1, 100), dataStr))
+
+        def tokens():
+            return " ".join([w[:rnd.randint(1, len(w))] for w in
+                             [word() for _ in
+                              range(rnd.randint(1, self.maxTokens))]])
+
+        corpus = [add() for _ in range(self.corpusSize)]
+        kinds = sorted(self.mix)
+        shares = []
+        total = 0.0
+        for kind in kinds:
+            total += self.mix[kind]
+            shares.append(total)
+        timed = []
+        for _ in range(self.numOfCommands):
+            kind = kinds[bisect_left(shares, rnd.random() * total)]
+            if kind == 'ADD' or (kind == 'DEL' and not live):
+                timed.append(add())
+            elif kind == 'DEL':
+                timed.append(('DEL', live.pop(rnd.randrange(len(live)))))
+            elif kind == 'QUERY':
+                timed.append(('QUERY', '%d %s' % (self.numOfResults,
+                                                  tokens())))
+            else:
+                boosts = ['%s:%.1f' % (rnd.choice(TYPES), rnd.uniform(0.5, 3))
+                          for _ in range(rnd.randint(1, 2))]
+                if live and rnd.random() < 0.5:
+                    boosts.append('%s:%.1f' % (rnd.choice(live),
+                                               rnd.uniform(0.5, 3)))
+                timed.append(('WQUERY', '%d %d %s %s' % (
+                    self.numOfResults, len(boosts), " ".join(boosts),
+                    tokens())))
+        return corpus, timed
+
+def storyQueries(numOfQueries=4000, seed=0):
+    '''returns the ADD lines of make_input and numOfQueries QUERY lines for
+       10 results of one to three prefixes of the words of its first 50
+       items, the load the benchmarks of the other modules share'''
+    #make_input draws from the global random, so the queries do too
+    random.seed(seed)
+    lines = search.make_input().split("\n")[1:-1]
+    adds = [line for line in lines if line.startswith('ADD')]
+    words = " ".join([line.split(" ", 4)[4] for line in adds[:50]]).split()
+    queries = []
+    for _ in range(numOfQueries):
+        tokens = " ".join([random.choice(words)[:random.randint(1, 3)]
+                           for _ in range(random.randint(1, 3))])
+        queries.append('QUERY 10 %s' % tokens)
+    return adds, queries
+
+def mainHandlerCommands():
+    #OrdDict caches nothing, and the zipf drawn queries repeat often enough
+    #that the cache would answer most of them, so it is turned off for the
+    #engines to do the same work
+    Main = search.MainHandler(cacheSize=0)
+    return {'ADD': Main.add, 'DEL': Main.delete,
+            'QUERY': Main.query, 'WQUERY': Main.wquery}
+
+def ordDictCommands():
+    Dict = typeahead_search_with_TRIE.OrdDict()
+    return {'ADD': Dict.add_command, 'DEL': Dict.delete_command,
+            'QUERY': Dict.query_command, 'WQUERY': Dict.wquery_command}
+
+#maps the name of an engine to a function returning its command functions
+ENGINES = {'search.MainHandler': mainHandlerCommands,
+           'typeahead_search_with_TRIE.OrdDict': ordDictCommands}
+
+class NullOutput(object):
+    '''takes the results both engines print, so that no run depends on how
+       fast the terminal is'''
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+def percentile(latencies, p):
+    '''the nearest rank percentile of sorted latencies'''
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+def runEngine(engine, corpus, timed):
+    '''runs the commands on a fresh engine, returning its results dict'''
+    startMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    commands = ENGINES[engine]()
+    latencies = dict([(kind, []) for kind in ('ADD', 'DEL', 'QUERY',
+                                              'WQUERY')])
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        inserted = 0
+        start = time.time()
+        for (kind, commandData) in corpus:
+            commands[kind](commandData, inserted)
+            inserted += 1
+        loadSeconds = time.time() - start
+        start = time.time()
+        for (kind, commandData) in timed:
+            before = time.time()
+            if kind == 'ADD':
+                commands[kind](commandData, inserted)
+                inserted += 1
+            else:
+                commands[kind](commandData)
+            latencies[kind].append(time.time() - before)
+        seconds = time.time() - start
+    finally:
+        sys.stdout = stdout
+    result = {'loadSeconds': loadSeconds, 'seconds': seconds,
+              'throughput': len(timed) / seconds if seconds else 0.0,
+              'peakMemoryKB': resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss - startMemory,
+              'commands': {}}
+    for (kind, times) in latencies.iteritems():
+        if not times:
+            continue
+        times.sort()
+        result['commands'][kind] = {
+            'count': len(times),
+            'meanMs': sum(times) / len(times) * 1000,
+            'p50Ms': percentile(times, 0.5) * 1000,
+            'p95Ms': percentile(times, 0.95) * 1000,
+            'p99Ms': percentile(times, 0.99) * 1000}
+    return result
+
+def _runEngine(conn, engine, corpus, timed):
+    conn.send(runEngine(engine, corpus, timed))
+    conn.close()
+
+def run(workload, engines=None):
+    '''runs the workload on every engine, each in a process of its own so
+       that the peak memory of one does not hide the other's, and returns
+       the results as a dict that can be saved as JSON'''
+    if engines is None:
+        engines = sorted(ENGINES)
+    corpus, timed = workload.commands()
+    results = {'params': workload.params(), 'engines': {}}
+    for engine in engines:
+        conn, childConn = Pipe()
+        child = Process(target=_runEngine,
+                        args=(childConn, engine, corpus, timed))
+        child.start()
+        results['engines'][engine] = conn.recv()
+        child.join()
+    return results
+
+def compare(results, baseline, tolerance=0.2, minDeltaMs=0.05):
+    '''returns a line for every throughput, p50 or p95 figure of the
+       results that is worse than the baseline's by more than tolerance,
+       and for latencies by more than minDeltaMs as well. The p99 of a few
+       hundred commands that take well under a millisecond is mostly
+       noise, so it is reported but not compared.
+
+       Figures of different workloads say nothing about each other, so a
+       baseline whose params differ from those of the results raises
+       ValueError, naming the params that differ.'''
+    params = baseline.get('params', {})
+    mismatches = ['%s %r, was %r' % (key, results['params'].get(key),
+                                     params.get(key))
+                  for key in sorted(set(results['params']) | set(params))
+                  if results['params'].get(key) != params.get(key)]
+    if mismatches:
+        raise ValueError('the baseline ran another workload: %s' %
+                         '; '.join(mismatches))
+    regressions = []
+    for (engine, result) in sorted(results['engines'].iteritems()):
+        base = baseline['engines'].get(engine)
+        if base is None:
+            continue
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append('%s throughput %.0f/s, was %.0f/s' % (
+                engine, result['throughput'], base['throughput']))
+        for (kind, stats) in sorted(result['commands'].iteritems()):
+            baseStats = base['commands'].get(kind)
+            if baseStats is None:
+                continue
+            for key in ('p50Ms', 'p95Ms'):
+                if stats[key] > baseStats[key] * (1 + tolerance) and \
+                   stats[key] - baseStats[key] > minDeltaMs:
+                    regressions.append('%s %s %s %.3fms, was %.3fms' % (
+                        engine, kind, key[:3], stats[key], baseStats[key]))
+    return regressions
+
+def compareLoads(seed=0):
+    '''returns the number of items of the make_input corpus and the
+       seconds a MainHandler takes to load them one add at a time and all
+       at once with bulkAdd, after checking that both give the same index'''
+    random.seed(seed)
+    adds = [line.split(" ", 1)[1] for line in
+            search.make_input().split("\n")[1:-1] if line.startswith('ADD')]
+    start = time.time()
+    Main = search.MainHandler(cacheSize=0)
+    for (insertionID, commandData) in enumerate(adds):
+        Main.add(commandData, insertionID)
+    addSeconds = time.time() - start
+    start = time.time()
+    Bulk = search.MainHandler(cacheSize=0)
+    Bulk.bulkAdd(adds)
+    bulkSeconds = time.time() - start
+    for tokens in ('a', 'th', 'he wa', 'q'):
+        if Main._evaluate({}, 100, tokens.split()) != \
+           Bulk._evaluate({}, 100, tokens.split()):
+            raise AssertionError('bulkAdd and add disagree on %r' % tokens)
+    return len(adds), addSeconds, bulkSeconds
+
+def report(results):
+    for (engine, result) in sorted(results['engines'].iteritems()):
+        print '%s: load %.2fs, %.0f commands/s, peak memory +%dKB' % (
+            engine, result['loadSeconds'], result['throughput'],
+            result['peakMemoryKB'])
+        for (kind, stats) in sorted(result['commands'].iteritems()):
+            print '  %-6s n=%-5d p50 %.3fms  p95 %.3fms  p99 %.3fms' % (
+                kind, stats['count'], stats['p50Ms'], stats['p95Ms'],
+                stats['p99Ms'])
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs the same seeded workload on the search engines.')
+    defaults = Workload()
+    parser.add_argument('--corpus', type=int, default=defaults.corpusSize)
+    parser.add_argument('--commands', type=int,
+                        default=defaults.numOfCommands)
+    parser.add_argument('--mix', default='ADD:0.1,DEL:0.05,QUERY:0.6,'
+                        'WQUERY:0.25', help='share of every command')
+    parser.add_argument('--vocabulary', choices=['story', 'synthetic'],
+                        default=defaults.vocabulary)
+    parser.add_argument('--vocabulary-size', type=int,
+                        default=defaults.vocabularySize)
+    parser.add_argument('--distribution', choices=['zipf', 'uniform'],
+                        default=defaults.distribution)
+    parser.add_argument('--zipf-exponent', type=float,
+                        default=defaults.zipfExponent)
+    parser.add_argument('--min-words', type=int, default=defaults.minWords)
+    parser.add_argument('--max-words', type=int, default=defaults.maxWords)
+    parser.add_argument('--max-tokens', type=int, default=defaults.maxTokens)
+    parser.add_argument('--results', type=int, default=defaults.numOfResults)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                        help='an engine to run, all of them by default')
+    parser.add_argument('--output', help='saves the results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--load', action='store_true',
+                        help='only times loading the make_input corpus with '
+                        'add and with bulkAdd')
+    args = parser.parse_args()
+
+    if args.load:
+        numOfItems, addSeconds, bulkSeconds = compareLoads(args.seed)
+        print '%d items: add %.2fs, bulkAdd %.2fs' % (numOfItems, addSeconds,
+                                                      bulkSeconds)
+        return
+
+    mix = {}
+    for part in args.mix.split(","):
+        [kind, share] = part.split(":")
+        mix[kind.upper()] = float(share)
+    workload = Workload(args.corpus, args.commands, mix, args.vocabulary,
+                        args.vocabulary_size, args.distribution,
+                        args.zipf_exponent, args.min_words, args.max_words,
+                        args.max_tokens, args.results, args.seed)
+    results = run(workload, args.engine)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            print 'NOT COMPARED', e
+            sys.exit(1)
+        for line in regressions:
+            print 'REGRESSION', line
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,662 @@
+import os
+import sys
+import json
+import shutil
+import random
+import struct
+import tempfile
+import asyncore
+import StringIO
+import threading
+
+import search
+import search_server
+import sharded_search
+import versioned_search
+import typeahead_search_with_TRIE
+
+TYPES = ['user','topic','question','board']
+#few and overlapping words, so that queries match many items and tokens
+#prefix one another
+WORDS = ("he hello help helper i in is it phone phones photo the then there "
+         "a an and cat").split()
+
+class Reference(object):
+    '''The simplest engine there is: every query scores every item. The
+       other engines must give the same results line for line.
+
+       Attributes:
+         items: maps an id to its [type, score, words, insertionID]
+    '''
+    def __init__(self):
+        self.items = {}
+
+    def add(self, commandData, insertionID):
+        [type_, id_, score, dataStr] = commandData.split(" ", 3)
+        self.items[id_] = [type_, float(score), dataStr.lower().split(),
+                           insertionID]
+
+    def delete(self, commandData):
+        del self.items[commandData]
+
+    def update(self, commandData):
+        [id_, score] = commandData.split()
+        self.items[id_][1] = float(score)
+
+    def top(self, boosts, numOfResults, queryTokens):
+        '''returns the (boosted score, insertionID, id) of every match,
+           best first'''
+        results = []
+        for (id_, (type_, score, words, insertionID)) in \
+            self.items.iteritems():
+            if all([token and any([word.startswith(token) for word in words])
+                    for token in queryTokens]):
+                #in the order MainHandler multiplies them, so that the
+                #products round the same
+                score = score * boosts.get(type_, 1.0) * boosts.get(id_, 1.0)
+                results.append((score, insertionID, id_))
+        results.sort(reverse=True)
+        return results
+
+    def query(self, boosts, numOfResults, queryTokens):
+        results = self.top(boosts, numOfResults, queryTokens)
+        return " ".join([id_ for (_, _, id_)
+                         in results[:max(numOfResults, 0)]])
+
+    def execute(self, line, inserted):
+        '''runs a command line, returning the result line of a query'''
+        [command, commandData] = line.split(" ", 1)
+        if command == 'ADD':
+            self.add(commandData, inserted)
+        elif command == 'DEL':
+            self.delete(commandData)
+        elif command == 'UPDATE':
+            self.update(commandData)
+        elif command == 'QUERY':
+            return self.query(*search.MainHandler.parseQuery(commandData))
+        elif command == 'WQUERY':
+            return self.query(*search.MainHandler.parseWquery(commandData))
+
+def workload(seed, numOfCommands=400, corpusSize=0, updates=True,
+             negativeScores=False):
+    '''returns the command lines of a seeded random workload, starting
+       with corpusSize ADDs. Scores are drawn from 1..19, or from -2..3
+       with negativeScores, so that many of them tie, and some boosts are
+       not positive.'''
+    rnd = random.Random(seed)
+    lines = []
+    live = []
+
+    def score():
+        if negativeScores:
+            return rnd.randrange(-2, 4)
+        return rnd.randrange(1, 20)
+
+    def tokens():
+        return " ".join([rnd.choice(WORDS)[:rnd.randint(1, 3)]
+                         for _ in range(rnd.randint(1, 3))])
+
+    for i in range(corpusSize + numOfCommands):
+        r = rnd.random()
+        if i < corpusSize or r < 0.4 or not live:
+            type_ = rnd.choice(TYPES)
+            id_ = '%s%d' % (type_[0], i)
+            words = " ".join([rnd.choice(WORDS)
+                              for _ in range(rnd.randint(1, 6))])
+            lines.append('ADD %s %s %d %s' % (type_, id_, score(), words))
+            live.append(id_)
+        elif r < 0.5:
+            lines.append('DEL %s' % live.pop(rnd.randrange(len(live))))
+        elif r < 0.6 and updates:
+            lines.append('UPDATE %s %d' % (rnd.choice(live), score()))
+        elif r < 0.8:
+            lines.append('QUERY %d %s' % (rnd.randint(0, 15), tokens()))
+        else:
+            boosts = []
+            for _ in range(rnd.randint(0, 3)):
+                if rnd.random() < 0.4:
+                    affected = rnd.choice(live)
+                else:
+                    affected = rnd.choice(TYPES)
+                boosts.append('%s:%.1f' % (affected, rnd.uniform(-1, 5)))
+            lines.append('WQUERY %d %d %s%s' % (
+                rnd.randint(0, 15), len(boosts),
+                "".join([boost + ' ' for boost in boosts]), tokens()))
+    return lines
+
+def expected(lines):
+    '''the result lines of the Reference for the command lines'''
+    ref = Reference()
+    results = []
+    for (inserted, line) in enumerate(lines):
+        result = ref.execute(line, inserted)
+        if result is not None:
+            results.append(result)
+    return results
+
+def executeLines(Main, lines):
+    '''the result lines of running the command lines one by one'''
+    results = []
+    for line in lines:
+        result = Main.execute(line)
+        if result is not None:
+            results.append(result)
+    return results
+
+def servedLines(Main, lines):
+    '''the lines serve writes for the command lines'''
+    out = StringIO.StringIO()
+    search.serve(StringIO.StringIO("%d\n%s\n" % (len(lines),
+                                                  "\n".join(lines))),
+                 out, flushEvery=16, Main=Main)
+    return out.getvalue().split("\n")[:-1]
+
+def printedLines(commands, lines):
+    '''the lines printed by the command functions of an engine that only
+       knows ADD, DEL, QUERY and WQUERY, as benchmark calls them'''
+    stdout = sys.stdout
+    sys.stdout = out = StringIO.StringIO()
+    try:
+        for (inserted, line) in enumerate(lines):
+            [command, commandData] = line.split(" ", 1)
+            if command == 'ADD':
+                commands[command](commandData, inserted)
+            else:
+                commands[command](commandData)
+    finally:
+        sys.stdout = stdout
+    return out.getvalue().split("\n")[:-1]
+
+def differences(got, want):
+    '''the number of result lines that differ, along with the first one'''
+    diffs = [(i, g, w) for (i, (g, w)) in enumerate(zip(got, want))
+             if g != w]
+    if len(got) != len(want):
+        diffs.append((min(len(got), len(want)), len(got), len(want)))
+    return len(diffs), diffs[:1]
+
+def handler(seed):
+    '''a MainHandler, that scores with the ColumnStore for every other seed
+       if NumPy is there'''
+    Main = search.MainHandler()
+    if seed % 2:
+        Main.columns = None
+    return Main
+
+############################################################################
+##############################Checks########################################
+def checkQueries(seeds):
+    '''MainHandler, one line at a time, in query batches and through
+       serve'''
+    failures = []
+    for seed in seeds:
+        lines = workload(seed)
+        want = expected(lines)
+        for (name, got) in [
+            ('execute', executeLines(handler(seed), lines)),
+            ('executeAll', list(handler(seed).executeAll(lines))),
+            ('serve', servedLines(handler(seed), lines))]:
+            count, first = differences(got, want)
+            if count:
+                failures.append('%s seed %d: %d lines, first %r' % (
+                    name, seed, count, first))
+    return failures
+
+def checkSessions(seeds):
+    '''QuerySessions typing queries a key at a time, with backspaces and
+       writes in between keys'''
+    failures = []
+    for seed in seeds:
+        rnd = random.Random(seed)
+        lines = workload(seed, updates=True)
+        Main = handler(seed)
+        ref = Reference()
+        session = Main.session()
+        typed = ""
+        target = ""
+        for (inserted, line) in enumerate(lines):
+            if Main.isQuery(line):
+                continue
+            Main.execute(line)
+            ref.execute(line, inserted)
+            for _ in range(rnd.randint(0, 3)):
+                if not target.startswith(typed) or typed == target:
+                    target = " ".join([rnd.choice(WORDS) for _ in
+                                       range(rnd.randint(1, 3))])
+                    typed = typed[:rnd.randint(0, len(typed))]
+                    continue
+                if rnd.random() < 0.15 and typed:
+                    typed = typed[:-1]
+                else:
+                    typed = target[:len(typed) + 1]
+                if not typed.strip() or typed.endswith(" "):
+                    continue
+                if rnd.random() < 0.5:
+                    query = '%d %s' % (rnd.randint(1, 10), typed)
+                    got = session.query(query)
+                    want = ref.execute('QUERY ' + query, None)
+                else:
+                    query = '%d 1 %s:%.1f %s' % (rnd.randint(1, 10),
+                                                 rnd.choice(TYPES),
+                                                 rnd.uniform(-1, 5), typed)
+                    got = session.wquery(query)
+                    want = ref.execute('WQUERY ' + query, None)
+                if got != want:
+                    failures.append('seed %d, %r: %r, not %r' % (
+                        seed, query, got, want))
+    return failures
+
+def checkShards(seeds):
+    '''ShardedHandler, one line at a time, pipelined and through serve, and
+       going on after commands that fail'''
+    failures = []
+    for seed in seeds[:4]:
+        lines = workload(seed)
+        want = expected(lines)
+        for numOfShards in (1, 3):
+            for name in ('execute', 'executeAll', 'serve'):
+                Main = sharded_search.ShardedHandler(numOfShards)
+                try:
+                    if name == 'execute':
+                        got = executeLines(Main, lines)
+                    elif name == 'executeAll':
+                        got = list(Main.executeAll(lines))
+                    else:
+                        got = servedLines(Main, lines)
+                finally:
+                    Main.close()
+                count, first = differences(got, want)
+                if count:
+                    failures.append('%s, %d shards, seed %d: %d lines, '
+                                    'first %r' % (name, numOfShards, seed,
+                                                  count, first))
+    Main = sharded_search.ShardedHandler(2)
+    try:
+        Main.execute('ADD user u1 1 hello')
+        for line in ['DEL nope', 'UPDATE nope 3', 'ADD user u2 x bad']:
+            Main.execute(line)
+        try:
+            Main._query({}, 5, None)
+            failures.append('a query that fails on the shards did not raise')
+        except RuntimeError:
+            pass
+        if Main.execute('QUERY 5 he') != 'u1' or \
+           Main.executeQueries(['QUERY 5 he', 'WQUERY 5 0 hel']) != \
+           ['u1', 'u1']:
+            failures.append('a shard did not survive failed commands')
+    finally:
+        Main.close()
+    return failures
+
+def checkVersions(seeds):
+    '''VersionedHandler, one line at a time and in bursts of writes, and
+       published versions that writes must leave as they were'''
+    failures = []
+    for seed in seeds:
+        lines = workload(seed)
+        want = expected(lines)
+        for (name, got) in [
+            ('execute', executeLines(versioned_search.VersionedHandler(),
+                                     lines)),
+            ('executeAll', list(versioned_search.VersionedHandler()
+                                .executeAll(lines)))]:
+            count, first = differences(got, want)
+            if count:
+                failures.append('%s seed %d: %d lines, first %r' % (
+                    name, seed, count, first))
+    Main = versioned_search.VersionedHandler()
+    Main.execute('ADD user u1 1 hello')
+    Main.execute('ADD user u2 2 hello')
+    version = Main.current
+    Main.execute('DEL u2')
+    Main.execute('ADD user u3 3 hello')
+    if version._evaluate({}, 5, ['he']) != 'u2 u1' or \
+       Main.current._evaluate({}, 5, ['he']) != 'u3 u1':
+        failures.append('a write changed a published version')
+    version = Main.current
+    Main.execute('UPDATE u1 4')
+    if version._evaluate({}, 5, ['he']) != 'u3 u1' or \
+       Main.current._evaluate({}, 5, ['he']) != 'u1 u3':
+        failures.append('UPDATE changed a published version')
+    return failures
+
+def checkSnapshots(seeds):
+    '''saving a snapshot half way and going on from a handler that loads
+       it, and rejecting snapshots that were damaged'''
+    directory = tempfile.mkdtemp()
+    try:
+        return snapshotFailures(seeds, os.path.join(directory, 'index.snap'))
+    finally:
+        shutil.rmtree(directory)
+
+def snapshotFailures(seeds, path):
+    '''checkSnapshots, with the snapshots written to path'''
+    failures = []
+    for seed in seeds:
+        lines = workload(seed)
+        half = len(lines) // 2
+        Main = handler(seed)
+        got = executeLines(Main, lines[:half])
+        Main.execute('SNAPSHOT SAVE %s' % path)
+        loaded = handler(seed)
+        loaded.execute('SNAPSHOT LOAD %s' % path)
+        if loaded.inserted != Main.inserted:
+            failures.append('seed %d: inserted %d, not %d' % (
+                seed, loaded.inserted, Main.inserted))
+        got += executeLines(loaded, lines[half:])
+        count, first = differences(got, expected(lines))
+        if count:
+            failures.append('seed %d: %d lines, first %r' % (seed, count,
+                                                             first))
+
+    data = open(path, 'rb').read()
+    damaged = {}
+    flipped = bytearray(data)
+    flipped[len(data) // 2] ^= 1
+    damaged['a flipped bit'] = flipped
+    newer = bytearray(data)
+    struct.pack_into('<I', newer, 4, search.SNAPSHOT_VERSION + 1)
+    damaged['a newer version'] = newer
+    damaged['a wrong magic'] = 'XXXX' + data[4:]
+    damaged['a truncated header'] = data[:search.SNAPSHOT_HEADER.size - 1]
+    damaged['a truncated body'] = data[:len(data) - 1]
+    for (name, contents) in sorted(damaged.iteritems()):
+        with open(path, 'wb') as f:
+            f.write(contents)
+        try:
+            search.MainHandler().loadSnapshot(path)
+        except ValueError:
+            continue
+        failures.append('a snapshot with %s was loaded' % name)
+    return failures
+
+def checkBulkAdd(seeds):
+    '''loading a corpus with bulkAdd against ADDing it line by line'''
+    failures = []
+    for seed in seeds:
+        lines = workload(seed, corpusSize=300)
+        Main = handler(seed)
+        Main.bulkAdd([line.split(" ", 1)[1] for line in lines[:300]])
+        got = executeLines(Main, lines[300:])
+        count, first = differences(got, expected(lines))
+        if count:
+            failures.append('seed %d: %d lines, first %r' % (seed, count,
+                                                             first))
+    return failures
+
+def checkMalformed(seeds):
+    '''an ADD that fails to parse takes no ordinal, and a bulkAdd with one
+       adds nothing'''
+    failures = []
+    Main = search.MainHandler()
+    for line in ['ADD user u1 1 hello', 'ADD user u2 x bad',
+                 'ADD user u3 2 hello', 'DEL u1', 'ADD user u4 x bad']:
+        try:
+            Main.execute(line)
+        except ValueError:
+            pass
+    if len(Main.ordinals) != 2 or Main.freeOrdinals != [0]:
+        failures.append('ADD lost ordinals: %d slots, free %r' % (
+            len(Main.ordinals), Main.freeOrdinals))
+    try:
+        Main.bulkAdd(['user u5 1 hello', 'user u6 x bad'])
+    except ValueError:
+        pass
+    if len(Main.items) != 1 or len(Main.ordinals) != 2 or \
+       Main.freeOrdinals != [0] or Main.inserted != 2:
+        failures.append('bulkAdd added part of a malformed batch')
+    if Main.execute('QUERY 5 he') != 'u3':
+        failures.append('malformed ADDs changed the results')
+    return failures
+
+def checkServer(seeds):
+    '''Server, over a Unix socket: one reply per command, in order, and
+       the commands it keeps from clients'''
+    directory = tempfile.mkdtemp()
+    try:
+        return serverFailures(seeds, os.path.join(directory, 'server.sock'))
+    finally:
+        shutil.rmtree(directory)
+
+def serverFailures(seeds, address):
+    '''checkServer, with the servers listening on address'''
+    failures = []
+
+    def serve(Main, lines):
+        #the turns of serveForever, until the client has all its replies
+        server = search_server.Server(address, Main)
+        done = threading.Event()
+
+        def loop():
+            while not done.is_set():
+                asyncore.loop(0.01, False, server.map, 1)
+                server.runTurn()
+            for conn in list(server.connections):
+                conn.close()
+            server.close()
+
+        thread = threading.Thread(target=loop)
+        thread.start()
+        try:
+            return search_server.sendAll(address, lines)
+        finally:
+            done.set()
+            thread.join()
+
+    for seed in seeds[:4]:
+        lines = workload(seed)
+        ref = Reference()
+        want = []
+        for (inserted, line) in enumerate(lines):
+            result = ref.execute(line, inserted)
+            want.append('OK' if result is None else result)
+        count, first = differences(serve(handler(seed), lines), want)
+        if count:
+            failures.append('seed %d: %d lines, first %r' % (seed, count,
+                                                             first))
+    search_server.Server.maxStanding = 2
+    Main = search.MainHandler()
+    try:
+        replies = serve(Main, [
+            'ADD user u1 1 hello', 'STANDING ADD a QUERY 5 he',
+            'STANDING ADD b QUERY 5 h', 'STANDING ADD c QUERY 5 hel',
+            'STANDING ADD a QUERY 5 hel', 'STANDING DEL b',
+            'STANDING ADD c QUERY 5 hel', 'STATS PROFILE 1', 'STATS RESET',
+            'SNAPSHOT SAVE %s.snap' % address, 'QUERY 5 he', 'STATS'])
+    finally:
+        del search_server.Server.maxStanding
+    refused = [reply.startswith('ERROR') for reply in replies]
+    if refused != [False, False, False, True, False, False, False, True,
+                   True, True, False, False]:
+        failures.append('the replies to the kept commands were %r' %
+                        replies)
+    elif Main.metrics.profileEvery or \
+         json.loads(replies[-1])['commands']['ADD']['count'] != 1:
+        failures.append('STATS over the socket gave %r' % replies[-1])
+    return failures
+
+def checkStats(seeds):
+    '''the command counts and index size STATS reports, one line at a time
+       and pipelined, and profiling and resetting them'''
+    failures = []
+    for seed in seeds[:4]:
+        lines = workload(seed)
+        counts = {}
+        ref = Reference()
+        for (inserted, line) in enumerate(lines):
+            command = line.split(" ", 1)[0]
+            counts[command] = counts.get(command, 0) + 1
+            ref.execute(line, inserted)
+        for name in ('execute', 'executeAll'):
+            Main = handler(seed)
+            if name == 'execute':
+                executeLines(Main, lines)
+            else:
+                list(Main.executeAll(lines))
+            stats = json.loads(Main.execute('STATS'))
+            got = dict([(command, summary['count']) for (command, summary)
+                        in stats['commands'].iteritems()])
+            if got != counts or stats['items'] != len(ref.items):
+                failures.append('%s seed %d: counts %r and %d items, not '
+                                '%r and %d' % (name, seed, got,
+                                               stats['items'], counts,
+                                               len(ref.items)))
+    Main = search.MainHandler()
+    Main.execute('ADD user u1 1 hello')
+    Main.execute('STATS PROFILE 1')
+    for line in ['QUERY 5 he', 'QUERY 5 hel', 'WQUERY 5 0 hello']:
+        Main.execute(line)
+    if not json.loads(Main.execute('STATS'))['profile']:
+        failures.append('STATS PROFILE 1 profiled no query')
+    Main.execute('STATS RESET')
+    stats = json.loads(Main.execute('STATS'))
+    if stats['commands'].keys() != ['STATS'] or stats['profile'] or \
+       stats['profileEvery'] != 1:
+        failures.append('STATS RESET left %r' % stats)
+    return failures
+
+def checkOrdDict(seeds):
+    '''OrdDict, with and without negative scores, merging its delta
+       segment often'''
+    failures = []
+    typeahead_search_with_TRIE.OrdDict.min_delta = 7
+    for seed in seeds:
+        lines = workload(seed, updates=False, negativeScores=seed % 2 == 1)
+        Dict = typeahead_search_with_TRIE.OrdDict()
+        got = printedLines({'ADD': Dict.add_command,
+                            'DEL': Dict.delete_command,
+                            'QUERY': Dict.query_command,
+                            'WQUERY': Dict.wquery_command}, lines)
+        count, first = differences(got, expected(lines))
+        if count:
+            failures.append('seed %d: %d lines, first %r' % (seed, count,
+                                                             first))
+    return failures
+
+def checkStanding(seeds):
+    '''standing queries against running the same queries afresh'''
+    failures = []
+    for seed in seeds:
+        lines = workload(seed)
+        Main = handler(seed)
+        queries = [line for line in lines if Main.isQuery(line)][:8]
+        for (i, line) in enumerate(queries):
+            Main.execute('STANDING ADD q%d %s' % (i, line))
+        ref = Reference()
+        for (inserted, line) in enumerate(lines):
+            ref.execute(line, inserted)
+            if Main.isQuery(line):
+                continue
+            Main.execute(line)
+            for (i, query) in enumerate(queries):
+                got = Main.execute('STANDING GET q%d' % i)
+                want = ref.execute(query, None)
+                if got != want:
+                    failures.append('seed %d after %r: %r is %r, not %r' % (
+                        seed, line, query, got, want))
+                    break
+    return failures
+
+def checkPages(seeds):
+    '''paging through queries with writes in between pages: every page has
+       to be the results that rank after its cursor at the time, and no
+       result may come twice unless it was UPDATEd since'''
+    failures = []
+    for seed in seeds:
+        rnd = random.Random(seed)
+        lines = workload(seed)
+        queries = [line for line in lines
+                   if line.startswith('QUERY') or line.startswith('WQUERY')]
+        Main = handler(seed)
+        ref = Reference()
+        #[query line, cursor, the pairs of the last result, the ids so far
+        #with the line they came back at]
+        paging = []
+        #maps an id to the line it was last UPDATEd at
+        updated = {}
+        for (inserted, line) in enumerate(lines):
+            if not Main.isQuery(line):
+                Main.execute(line)
+                ref.execute(line, inserted)
+            if line.startswith('UPDATE'):
+                updated[line.split(" ")[1]] = inserted
+            if rnd.random() < 0.3:
+                [command, queryData] = rnd.choice(queries).split(" ", 1)
+                pageSize = rnd.randint(1, 6)
+                queryData = '%d %s' % (pageSize, queryData.split(" ", 1)[1])
+                paging.append(['%s %s' % (command, queryData), '-', None,
+                               {}])
+            for state in list(paging):
+                if rnd.random() < 0.5:
+                    continue
+                (query, cursor, last, seen) = state
+                [command, queryData] = query.split(" ", 1)
+                if command == 'QUERY':
+                    args = Main.parseQuery(queryData)
+                else:
+                    args = Main.parseWquery(queryData)
+                ranks = [rank for rank in ref.top(*args)
+                         if last is None or rank[:2] < last]
+                want = [id_ for (_, _, id_) in ranks[:args[1]]]
+                reply = Main.execute('PAGE %s %s' % (cursor, query))
+                ids = reply.split(" ")[1:]
+                cursor = reply.split(" ")[0]
+                repeats = [id_ for id_ in ids if id_ in seen and
+                           updated.get(id_, -1) <= seen[id_]]
+                if ids != want or (cursor == '-') != (len(ranks) <= args[1]) \
+                   or repeats:
+                    failures.append('seed %d, %r: %r, not %r' % (
+                        seed, query, ids, want))
+                    paging.remove(state)
+                    continue
+                seen.update([(id_, inserted) for id_ in ids])
+                if cursor == '-':
+                    paging.remove(state)
+                else:
+                    state[1] = cursor
+                    state[2] = ranks[args[1] - 1][:2]
+    return failures
+
+#the checks main runs, by name
+CHECKS = [('queries', checkQueries),
+          ('sessions', checkSessions),
+          ('shards', checkShards),
+          ('versions', checkVersions),
+          ('snapshots', checkSnapshots),
+          ('bulkAdd', checkBulkAdd),
+          ('malformed ADDs', checkMalformed),
+          ('server', checkServer),
+          ('stats', checkStats),
+          ('OrdDict', checkOrdDict),
+          ('standing queries', checkStanding),
+          ('pages', checkPages)]
+
+def shrink():
+    '''makes the chunks, bitmap containers and nodes small, so that the few
+       hundred items of a workload already split chunks, turn containers
+       dense and sparse again and fan nodes out'''
+    search.RankedList.chunkSize = 2
+    search.Bitmap.arrayLimit = 6
+    search.TrieNode.fanoutLimit = 2
+
+def main():
+    '''equivalence.py [number of seeds]
+
+       runs seeded workloads on every engine and path against the
+       Reference, printing the checks that failed, and exits with 1 if
+       any did'''
+    numOfSeeds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seeds = range(numOfSeeds)
+    shrink()
+    failed = False
+    for (name, check) in CHECKS:
+        failures = check(seeds)
+        print '%s: %s' % (name, 'FAILED' if failures else 'ok')
+        for failure in failures[:5]:
+            print '  ' + failure
+        failed = failed or bool(failures)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
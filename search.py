@@ -1,7 +1,25 @@
-import copy
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import select
 import random
 import time
 import heapq
+import binascii
+import cProfile
+import pstats
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
+try:
+    import numpy
+except ImportError:
+    #without NumPy every match is scored one at a time, see ColumnStore
+    numpy = None
 
 class Item(object):
     '''Item is what's ADDed, where it's data string is what's matched
@@ -13,13 +31,18 @@ class Item(object):
          score
          dataStr: this is what's matched against the queries
          insertionID: newly added items will have larger insertionIDs
+         ordinal: a small integer that is unique among the items currently
+         in the index, used as the item's position within a Bitmap
     '''
-    def __init__(self, type_, id_, score, dataStr, insertionID):
+    def __init__(self, type_, id_, score, dataStr, insertionID, ordinal=None):
         self.type = type_
         self.id = id_
         self.score = float(score)
         self.dataStr = dataStr
         self.insertionID = insertionID
+        self.ordinal = ordinal
+        #sorts ascending in the same order that __cmp__ sorts descending
+        self.rank = (-self.score, -insertionID, self)
         
     def __repr__(self):
         info = (self.type, self.id, self.score, self.dataStr)
@@ -36,62 +59,904 @@ class Item(object):
     def __eq__(self, other):
         return self.id == other.id
 
+class Edit(object):
+    '''One write to a copy-on-write index, see versioned_search.
+
+       The objects created by the write belong to the version it is
+       building and are updated in place. Any other object may be shared
+       with versions that readers still hold, so it is copied first and
+       the copy takes its place.
+
+       Attributes:
+         fresh: maps the id() of every object the write created to the
+         object, which also keeps the ids from being reused
+    '''
+    def __init__(self):
+        self.fresh = {}
+
+    def own(self, obj):
+        '''marks an object created by the write as its own'''
+        self.fresh[id(obj)] = obj
+        return obj
+
+    def writable(self, obj, copy):
+        '''returns the object if the write created it, and otherwise a
+           copy of it made by calling copy on it'''
+        if id(obj) in self.fresh:
+            return obj
+        return self.own(copy(obj))
+
 class TrieNode(object):
-    '''A node within a trie.
+    '''A node within a path compressed trie.
+
+       Attributes:
+         label: the characters on the edge from the parent to the node
+         keys: the first characters of the children's labels, in sorted
+         order, while the node has at most fanoutLimit children;
+         None once it has more
+         children: the child nodes, in the order of keys, or a dict from
+         the first character of their label to the child when keys is None
+         items: PostingList of the objects of type Item that contain the
+         prefixes that end within the label of the node
+    '''
+    __slots__ = ('label', 'keys', 'children', 'items')
+    fanoutLimit = 8
+
+    def __init__(self, label=""):
+        self.label = label
+        self.keys = ""
+        self.children = []
+        self.items = PostingList()
+
+    def copy(self):
+        '''a copy of the node that shares its items and children'''
+        other = TrieNode(self.label)
+        other.keys = self.keys
+        if self.keys is None:
+            other.children = dict(self.children)
+        else:
+            other.children = list(self.children)
+        other.items = self.items
+        return other
+
+    def child(self, ltr):
+        keys = self.keys
+        if keys is None:
+            return self.children.get(ltr)
+        i = keys.find(ltr)
+        if i < 0:
+            return None
+        return self.children[i]
+
+    def childCount(self):
+        return len(self.children)
+
+    def iterChildren(self):
+        if self.keys is None:
+            return iter([self.children[k] for k in sorted(self.children)])
+        return iter(self.children)
+
+    def addChild(self, node):
+        ltr = node.label[0]
+        keys = self.keys
+        if keys is None:
+            self.children[ltr] = node
+        elif len(keys) < self.fanoutLimit:
+            i = bisect_left(keys, ltr)
+            self.keys = keys[:i] + ltr + keys[i:]
+            self.children.insert(i, node)
+        else:
+            self.children = dict(zip(keys, self.children))
+            self.children[ltr] = node
+            self.keys = None
+
+    def replaceChild(self, node):
+        '''puts the node in place of the child starting with the same
+           character'''
+        ltr = node.label[0]
+        if self.keys is None:
+            self.children[ltr] = node
+        else:
+            self.children[self.keys.index(ltr)] = node
+
+    def removeChild(self, node):
+        ltr = node.label[0]
+        if self.keys is None:
+            del self.children[ltr]
+            if len(self.children) <= self.fanoutLimit // 2:
+                self.keys = "".join(sorted(self.children))
+                self.children = [self.children[k] for k in self.keys]
+        else:
+            i = self.keys.index(ltr)
+            self.keys = self.keys[:i] + self.keys[i+1:]
+            del self.children[i]
+
+class PostingList(object):
+    '''The items of a trie node, partitioned by their type.
+
+       The items of every type are kept best first, i.e. by descending
+       (score, insertionID) just like Item.__cmp__ orders them, and
+       iterating over the posting list merges the types back together.
+       Boosting a type scales all of its scores by the same factor, so
+       each type's order survives any type boost.
+
+       Attributes:
+         typed: maps an item type to the RankedList of its items
+         bitmap: Bitmap of the ordinals of the items, for membership tests
+         and intersections
+    '''
+    def __init__(self):
+        self.typed = {}
+        self.bitmap = Bitmap()
+
+    def __len__(self):
+        return len(self.bitmap)
+
+    def __iter__(self):
+        for rank in mergeRanks(self.typed.values()):
+            yield rank[2]
+
+    def __contains__(self, item):
+        return item.ordinal in self.bitmap
+
+    @classmethod
+    def fromSorted(cls, typed, ordinals):
+        '''builds the posting list out of a dict from each type to the
+           sorted ranks of its items and the sorted ordinals of all items'''
+        postings = cls()
+        for (type_, ranks) in typed.iteritems():
+            postings.typed[type_] = RankedList.fromSorted(ranks)
+        postings.bitmap = Bitmap.fromSorted(ordinals)
+        return postings
+
+    def copy(self):
+        other = PostingList()
+        for (type_, ranks) in self.typed.iteritems():
+            other.typed[type_] = ranks.copy()
+        other.bitmap = self.bitmap.copy()
+        return other
+
+    def shallowCopy(self):
+        '''a copy that shares its RankedLists and the containers of its
+           Bitmap, to be updated within an Edit, which copies them before
+           they change'''
+        other = PostingList()
+        other.typed = dict(self.typed)
+        other.bitmap = self.bitmap.shallowCopy()
+        return other
+
+    def add(self, item, edit=None):
+        if not self.bitmap.add(item.ordinal, edit):
+            return
+        try:
+            ranks = self.typed[item.type]
+        except KeyError:
+            ranks = self.typed[item.type] = RankedList()
+        if edit is not None:
+            ranks = self.typed[item.type] = \
+                edit.writable(ranks, RankedList.shallowCopy)
+        ranks.add(item.rank, edit)
+
+    def discard(self, item, edit=None):
+        if not self.bitmap.discard(item.ordinal, edit):
+            return
+        ranks = self.typed[item.type]
+        if edit is not None:
+            ranks = self.typed[item.type] = \
+                edit.writable(ranks, RankedList.shallowCopy)
+        ranks.discard(item.rank, edit)
+        if not ranks:
+            del self.typed[item.type]
+
+    def rescore(self, item, old, new, edit=None):
+        '''moves an item that is in the posting list from its old rank to
+           the new one; its ordinal and so the Bitmap stay the same'''
+        ranks = self.typed[item.type]
+        if edit is not None:
+            ranks = self.typed[item.type] = \
+                edit.writable(ranks, RankedList.shallowCopy)
+        ranks.discard(old, edit)
+        ranks.add(new, edit)
+
+def mergeRanks(iterables):
+    '''merges ascending streams of rank tuples into one'''
+    if len(iterables) == 1:
+        return iter(iterables[0])
+    return heapq.merge(*iterables)
+
+def boostedRanks(ranks, boost, matched, idBoosts):
+    '''yields the ranks of one type's items that are in the matched
+       Bitmap, with their scores scaled by the type's positive boost and
+       the id boosted items left out'''
+    for rank in ranks:
+        item = rank[2]
+        if item.ordinal in matched and item.id not in idBoosts:
+            yield (rank[0] * boost, rank[1], item)
+
+class RankedList(object):
+    '''A sorted list of Item.rank tuples, stored as a list of sorted
+       chunks so that adding or discarding a rank only shifts the entries
+       of a single chunk.
+
+       Attributes:
+         chunks: the sorted chunks, each at most 2*chunkSize long
+         maxes: the last rank of every chunk, used to bisect for a chunk
+    '''
+    chunkSize = 256
+
+    def __init__(self):
+        self.chunks = []
+        self.maxes = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            for rank in chunk:
+                yield rank
+
+    @classmethod
+    def fromSorted(cls, ranks):
+        '''builds the list out of ranks that are already sorted'''
+        other = cls()
+        size = cls.chunkSize
+        other.chunks = [ranks[i:i + size] for i in xrange(0, len(ranks), size)]
+        other.maxes = [chunk[-1] for chunk in other.chunks]
+        other.size = len(ranks)
+        return other
+
+    def copy(self):
+        other = RankedList()
+        other.chunks = [list(chunk) for chunk in self.chunks]
+        other.maxes = list(self.maxes)
+        other.size = self.size
+        return other
+
+    def shallowCopy(self):
+        other = RankedList()
+        other.chunks = list(self.chunks)
+        other.maxes = list(self.maxes)
+        other.size = self.size
+        return other
+
+    def after(self, rank, boost=1.0):
+        '''yields the ranks that come after a (-score, -insertionID) pair
+           once their scores are scaled by a positive boost. The boost
+           keeps the order, so the first of them is found by bisecting.'''
+        def reached(other):
+            return (other[0] * boost, other[1]) > rank
+
+        maxes = self.maxes
+        lo, hi = 0, len(maxes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if reached(maxes[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == len(maxes):
+            return
+        chunk = self.chunks[lo]
+        i, hi = 0, len(chunk)
+        while i < hi:
+            mid = (i + hi) // 2
+            if reached(chunk[mid]):
+                hi = mid
+            else:
+                i = mid + 1
+        for rank in islice(chunk, i, None):
+            yield rank
+        for chunk in islice(self.chunks, lo + 1, None):
+            for rank in chunk:
+                yield rank
+
+    def add(self, rank, edit=None):
+        maxes = self.maxes
+        if not maxes:
+            self.chunks.append([rank])
+            maxes.append(rank)
+            self.size = 1
+            return
+        pos = bisect_left(maxes, rank)
+        last = pos == len(maxes)
+        if last:
+            #worse than everything in the list
+            pos -= 1
+        chunk = self.chunks[pos]
+        if edit is not None:
+            chunk = self.chunks[pos] = edit.writable(chunk, list)
+        if last:
+            chunk.append(rank)
+            maxes[pos] = rank
+        else:
+            chunk.insert(bisect_left(chunk, rank), rank)
+        self.size += 1
+        if len(chunk) > 2 * self.chunkSize:
+            half = chunk[self.chunkSize:]
+            del chunk[self.chunkSize:]
+            self.chunks.insert(pos + 1, half)
+            maxes[pos] = chunk[-1]
+            maxes.insert(pos + 1, half[-1])
+
+    def discard(self, rank, edit=None):
+        maxes = self.maxes
+        pos = bisect_left(maxes, rank)
+        chunk = self.chunks[pos]
+        if edit is not None:
+            chunk = self.chunks[pos] = edit.writable(chunk, list)
+        i = bisect_left(chunk, rank)
+        del chunk[i]
+        self.size -= 1
+        if not chunk:
+            del self.chunks[pos]
+            del maxes[pos]
+        elif i == len(chunk):
+            maxes[pos] = chunk[-1]
+
+#the positions of the set bits of every byte value
+_BYTE_BITS = [tuple([b for b in range(8) if byte >> b & 1])
+              for byte in range(256)]
+
+def _bufToLows(buf):
+    '''yields the set bits of a full container's bytearray in order'''
+    for (i, byte) in enumerate(buf):
+        if byte:
+            base = i << 3
+            for b in _BYTE_BITS[byte]:
+                yield base | b
+
+def _bufToLong(buf):
+    return long(binascii.hexlify(buf[::-1]), 16)
+
+def _longToBuf(bits):
+    return bytearray(binascii.unhexlify('%016384x' % bits))[::-1]
+
+def _copyContainer(container):
+    if type(container) is list:
+        return [bytearray(container[0])] + container[1:]
+    return container[:]
+
+class Bitmap(object):
+    '''A compressed set of item ordinals, laid out like a Roaring bitmap.
+
+       The ordinals are grouped by their high 16 bits into containers.
+       A container holding at most arrayLimit values is a sorted
+       array('H') of the low 16 bits. A fuller one is a [buf, count, bits]
+       list, where buf is a bytearray with one bit per low value that is
+       updated in place, and bits caches it as a long between updates so
+       that intersecting two full containers is a single long &.
+
+       Attributes:
+         containers: maps the high bits to the container of the low bits
+         size: the number of ordinals in the bitmap
+    '''
+    __slots__ = ('containers', 'size')
+    arrayLimit = 4096
+
+    def __init__(self):
+        self.containers = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, ordinal):
+        container = self.containers.get(ordinal >> 16)
+        if container is None:
+            return False
+        low = ordinal & 0xFFFF
+        if type(container) is list:
+            return container[0][low >> 3] >> (low & 7) & 1 == 1
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << 16
+            if type(container) is list:
+                lows = _bufToLows(container[0])
+            else:
+                lows = container
+            for low in lows:
+                yield base | low
+
+    @classmethod
+    def fromSorted(cls, ordinals):
+        '''builds the bitmap out of ordinals in ascending order'''
+        bitmap = cls()
+        start = 0
+        while start < len(ordinals):
+            high = ordinals[start] >> 16
+            end = bisect_left(ordinals, (high + 1) << 16, start)
+            lows = [ordinal & 0xFFFF for ordinal in ordinals[start:end]]
+            if len(lows) > cls.arrayLimit:
+                buf = bytearray(8192)
+                for low in lows:
+                    buf[low >> 3] |= 1 << (low & 7)
+                bitmap.containers[high] = [buf, len(lows), None]
+            else:
+                bitmap.containers[high] = array('H', lows)
+            start = end
+        bitmap.size = len(ordinals)
+        return bitmap
+
+    def copy(self):
+        other = Bitmap()
+        for (high, container) in self.containers.iteritems():
+            other.containers[high] = _copyContainer(container)
+        other.size = self.size
+        return other
+
+    def shallowCopy(self):
+        other = Bitmap()
+        other.containers = dict(self.containers)
+        other.size = self.size
+        return other
+
+    def add(self, ordinal, edit=None):
+        '''adds the ordinal, returning False if it was already present'''
+        high, low = ordinal >> 16, ordinal & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array('H', [low])
+        elif type(container) is list:
+            buf = container[0]
+            bit = 1 << (low & 7)
+            if buf[low >> 3] & bit:
+                return False
+            if edit is not None:
+                container = self.containers[high] = \
+                    edit.writable(container, _copyContainer)
+                buf = container[0]
+            buf[low >> 3] |= bit
+            container[1] += 1
+            container[2] = None
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return False
+            if edit is not None:
+                container = self.containers[high] = \
+                    edit.writable(container, _copyContainer)
+            container.insert(i, low)
+            if len(container) > self.arrayLimit:
+                buf = bytearray(8192)
+                for low in container:
+                    buf[low >> 3] |= 1 << (low & 7)
+                self.containers[high] = [buf, len(container), None]
+        self.size += 1
+        return True
+
+    def discard(self, ordinal, edit=None):
+        '''removes the ordinal, returning False if it was not present'''
+        high, low = ordinal >> 16, ordinal & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            return False
+        if type(container) is list:
+            buf = container[0]
+            bit = 1 << (low & 7)
+            if not buf[low >> 3] & bit:
+                return False
+            if edit is not None:
+                container = self.containers[high] = \
+                    edit.writable(container, _copyContainer)
+                buf = container[0]
+            buf[low >> 3] ^= bit
+            container[1] -= 1
+            container[2] = None
+            #only shrink well below the limit so that an item going back and
+            #forth across it does not convert the container every time
+            if container[1] <= self.arrayLimit // 2:
+                self.containers[high] = array('H', _bufToLows(buf))
+        else:
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                return False
+            if edit is not None:
+                container = self.containers[high] = \
+                    edit.writable(container, _copyContainer)
+            del container[i]
+            if not container:
+                del self.containers[high]
+        self.size -= 1
+        return True
+
+    def __and__(self, other):
+        if len(other.containers) < len(self.containers):
+            self, other = other, self
+        result = Bitmap()
+        for (high, mine) in self.containers.iteritems():
+            theirs = other.containers.get(high)
+            if theirs is None:
+                continue
+            if type(mine) is list and type(theirs) is list:
+                for container in (mine, theirs):
+                    if container[2] is None:
+                        container[2] = _bufToLong(container[0])
+                bits = mine[2] & theirs[2]
+                count = bin(bits).count("1")
+                if count > self.arrayLimit:
+                    container = [_longToBuf(bits), count, bits]
+                else:
+                    container = array('H', _bufToLows(_longToBuf(bits)))
+            elif type(mine) is list or type(theirs) is list:
+                if type(mine) is list:
+                    mine, theirs = theirs, mine
+                buf = theirs[0]
+                container = array('H', [low for low in mine
+                                        if buf[low >> 3] >> (low & 7) & 1])
+            else:
+                if len(theirs) < len(mine):
+                    mine, theirs = theirs, mine
+                theirs = set(theirs)
+                container = array('H', [low for low in mine
+                                        if low in theirs])
+            if type(container) is list:
+                result.containers[high] = container
+                result.size += container[1]
+            elif container:
+                result.containers[high] = container
+                result.size += len(container)
+        return result
+
+class Conjunction(object):
+    '''The ordinals that are in every one of a list of Bitmaps, tested one
+       ordinal at a time rather than by intersecting the Bitmaps, for
+       queries that only look at a few of the items of the rarest token.
 
        Attributes:
-         char: the character that the node represents
-         middle: the set of nodes that branch off the node
-         items: set of objects of type Item that contain the prefixes
-         upto the node within their data string
-    '''         
-    def __init__(self, c=""):
-        self.char = c
-        self.middle = {}
-        self.items = set()
+         bitmaps: the Bitmaps, tested in order
+    '''
+    def __init__(self, bitmaps):
+        self.bitmaps = bitmaps
+
+    def __contains__(self, ordinal):
+        for bitmap in self.bitmaps:
+            if ordinal not in bitmap:
+                return False
+        return True
+
+    def __len__(self):
+        '''an upper bound on the number of ordinals, which is all the
+           callers of _candidates need'''
+        return min([len(bitmap) for bitmap in self.bitmaps])
+
+def distinctPrefixes(words):
+    '''yields every distinct word once, in sorted order, along with the
+       length of the prefix it shares with the word before it; the nodes
+       of that shared prefix have already been visited for the item'''
+    prev = ""
+    for word in sorted(set(words)):
+        start = 0
+        for (a, b) in zip(prev, word):
+            if a != b:
+                break
+            start += 1
+        yield word, start
+        prev = word
+
+def mergeRuns(runs):
+    '''merges sorted lists of numbers into one sorted list without
+       repeats; an item can be under several words of a node, so it can
+       show up in more than one of the runs'''
+    runs = [run for run in runs if run]
+    if len(runs) == 1:
+        return runs[0]
+    return sorted(set().union(*runs))
+
+class BulkBuild(object):
+    '''The state of Trie.build while it goes over the sorted words.
+
+       Attributes:
+         words: the distinct words of the items, sorted
+         positionsOf: maps a word to a dict from each item type to the
+         sorted rank positions of the items of that type with the word
+         ordinalsOf: maps a word to the ordinals of the items with it
+         ranks: the ranks of all the items, by rank position
+    '''
+    def __init__(self, words, positionsOf, ordinalsOf, ranks):
+        self.words = words
+        self.positionsOf = positionsOf
+        self.ordinalsOf = ordinalsOf
+        self.ranks = ranks
+
+    def nodes(self, lo, hi, depth):
+        '''returns the nodes for words[lo:hi], which share their first depth
+           characters and are all longer than that, along with the sorted
+           rank positions of their items by type and their sorted
+           ordinals'''
+        words = self.words
+        ranks = self.ranks
+        nodes = []
+        runsOf = {}
+        ordinalRuns = []
+        while lo < hi:
+            first = words[lo]
+            ltr = first[depth]
+            end = lo + 1
+            while end < hi and words[end][depth] == ltr:
+                end += 1
+            #the words are sorted, so the first and last word of the group
+            #share exactly the prefix every word of the group shares
+            last = words[end - 1]
+            n = depth + 1
+            while n < len(first) and first[n] == last[n]:
+                n += 1
+            node = TrieNode(first[depth:n])
+            if len(first) == n:
+                children, typed, ordinals = self.nodes(lo + 1, end, n)
+                for (type_, positions) in \
+                    self.positionsOf[first].iteritems():
+                    typed[type_] = mergeRuns([positions,
+                                              typed.get(type_, [])])
+                ordinals = mergeRuns([sorted(self.ordinalsOf[first]),
+                                      ordinals])
+            else:
+                children, typed, ordinals = self.nodes(lo, end, n)
+            for child in children:
+                node.addChild(child)
+            node.items = PostingList.fromSorted(
+                dict([(type_, [ranks[position] for position in positions])
+                      for (type_, positions) in typed.iteritems()]),
+                ordinals)
+            nodes.append(node)
+            for (type_, positions) in typed.iteritems():
+                runsOf.setdefault(type_, []).append(positions)
+            ordinalRuns.append(ordinals)
+            lo = end
+        typed = dict([(type_, mergeRuns(runs))
+                      for (type_, runs) in runsOf.iteritems()])
+        return nodes, typed, mergeRuns(ordinalRuns)
 
 class Trie(object):
+    '''A path compressed (radix) trie over the words of the items' data
+       strings. Chains of nodes that hold the same items are kept as a
+       single node, and branches are pruned once their items are removed.
+
+       Attributes:
+         root: the TrieNode of the empty prefix
+         edit: None while the trie is updated in place; within an Edit the
+         nodes and posting lists that are not the edit's own are copied
+         before they change, so the ones reachable from the old root never
+         do
+    '''
     def __init__(self):
         self.root = TrieNode()
+        self.edit = None
+
+    def _own(self, parent, node):
+        '''returns the node if it can be changed in place, and otherwise puts
+           a copy of it that can in place of it in the parent'''
+        edit = self.edit
+        if edit is None or id(node) in edit.fresh:
+            return node
+        copy = edit.own(node.copy())
+        parent.replaceChild(copy)
+        return copy
+
+    def _postings(self, node):
+        '''returns the items of a node that _own returned, ready to change'''
+        if self.edit is not None:
+            node.items = self.edit.writable(node.items,
+                                            PostingList.shallowCopy)
+        return node.items
+
+    def _ownRoot(self):
+        if self.edit is not None:
+            self.root = self.edit.writable(self.root, TrieNode.copy)
             
+    @classmethod
+    def build(cls, items):
+        '''builds the trie of the items in a single bottom up pass over
+           their sorted words, giving the same trie as inserting the items
+           one at a time.
+
+           The items are numbered by their position in rank order, so the
+           posting lists of the nodes are built by merging sorted lists of
+           small ints on the way up and only turned into ranks at the end.
+        '''
+        items = sorted(items, key=lambda item: item.rank)
+        ranks = [item.rank for item in items]
+        positionsOf = {}
+        ordinalsOf = {}
+        for (position, item) in enumerate(items):
+            for word in set(item.dataStr.lower().split()):
+                try:
+                    positionsOf[word].setdefault(item.type, []).append(position)
+                    ordinalsOf[word].append(item.ordinal)
+                except KeyError:
+                    positionsOf[word] = {item.type: [position]}
+                    ordinalsOf[word] = [item.ordinal]
+        trie = cls()
+        words = sorted(positionsOf)
+        build = BulkBuild(words, positionsOf, ordinalsOf, ranks)
+        for child in build.nodes(0, len(words), 0)[0]:
+            trie.root.addChild(child)
+        return trie
+
     def remove(self, words, item):
         '''removes an item from the set of items in all the nodes
            within the path in the trie, of every word in the item's
            data string'''
-        for word in words:
+        self._ownRoot()
+        words = list(distinctPrefixes(words))
+        for (word, start) in words:
             currNode = self.root
-            for i,ltr in enumerate(word):
-                currNode = currNode.middle[ltr]
-                currNode.items.discard(item)
+            depth = 0
+            while depth < len(word):
+                currNode = self._own(currNode, currNode.child(word[depth]))
+                if depth >= start:
+                    self._postings(currNode).discard(item, self.edit)
+                depth += len(currNode.label)
+        for (word, start) in words:
+            self._compact(word)
+
+    def _compact(self, word):
+        '''prunes the empty node on the path of the word, and merges the
+           nodes on the path that ended up with the same items as their
+           only child'''
+        currNode = self.root
+        depth = 0
+        while depth < len(word):
+            child = currNode.child(word[depth])
+            if child is None:
+                return
+            if not child.items:
+                currNode.removeChild(child)
+                return
+            child = self._own(currNode, child)
+            while child.childCount() == 1:
+                only = next(child.iterChildren())
+                if len(only.items) != len(child.items):
+                    break
+                only = self._own(child, only)
+                only.label = child.label + only.label
+                currNode.replaceChild(only)
+                child = only
+            depth += len(child.label)
+            currNode = child
         
     def insert(self, words, item):
         '''includes the item in the set of items in all the nodes
            within the path in the trie, of every word in the item's
            data string
         '''
-        for word in words:
+        self._ownRoot()
+        for (word, start) in distinctPrefixes(words):
             currNode = self.root
-            for i,ltr in enumerate(word):
-                try:
-                    currNode = currNode.middle[ltr]
-                except KeyError:
-                    newNode = TrieNode(ltr)
-                    currNode.middle[ltr] = newNode
-                    currNode = currNode.middle[ltr]
-                currNode.items.add(item)
+            depth = 0
+            while depth < len(word):
+                child = currNode.child(word[depth])
+                if child is None:
+                    child = TrieNode(word[depth:])
+                    if self.edit is not None:
+                        self.edit.own(child)
+                    currNode.addChild(child)
+                else:
+                    child = self._own(currNode, child)
+                    label = child.label
+                    n = 1
+                    while n < len(label) and depth + n < len(word) and \
+                          label[n] == word[depth + n]:
+                        n += 1
+                    if n < len(label):
+                        child = self._split(currNode, child, n)
+                if depth >= start:
+                    self._postings(child).add(item, self.edit)
+                depth += len(child.label)
+                currNode = child
+
+    def rescore(self, words, item, old, new):
+        '''moves the item from its old rank to the new one in all the
+           nodes within the path in the trie, of every word in the item's
+           data string. No node is added, split or merged and no Bitmap
+           changes, so this only costs a bisect of one RankedList per
+           node. The nodes of a snapshot are decoded with the item's rank
+           at the time, so item.rank has to be the old rank until this
+           returns.'''
+        self._ownRoot()
+        for (word, start) in distinctPrefixes(words):
+            currNode = self.root
+            depth = 0
+            while depth < len(word):
+                currNode = self._own(currNode, currNode.child(word[depth]))
+                if depth >= start:
+                    self._postings(currNode).rescore(item, old, new,
+                                                     self.edit)
+                depth += len(currNode.label)
+
+    def _split(self, parent, child, n):
+        '''puts a new node holding the first n characters of the child's
+           label between the parent and the child'''
+        upper = TrieNode(child.label[:n])
+        upper.items = child.items.copy()
+        if self.edit is not None:
+            self.edit.own(upper)
+            self.edit.own(upper.items)
+        child.label = child.label[n:]
+        parent.replaceChild(upper)
+        upper.addChild(child)
+        return upper
         
     def isPrefix(self, word):
         '''returns the set of items at the end of the path of the word in the
            trie if the word is in the trie
         '''
         currNode = self.root
-        for i,ltr in enumerate(word):
-            try:
-                currNode = currNode.middle[ltr]
-            except KeyError:
-                return set()
+        depth = 0
+        while depth < len(word):
+            currNode = currNode.child(word[depth])
+            if currNode is None:
+                return PostingList()
+            label = currNode.label
+            if word[depth:depth + len(label)] != label[:len(word) - depth]:
+                return PostingList()
+            depth += len(label)
         return currNode.items
 
+    def descend(self, node, offset, chars):
+        '''returns the (node, offset) position reached by following the
+           chars from offset characters into the label of the node, or None
+           if no word continues that way'''
+        for ltr in chars:
+            if offset < len(node.label):
+                if node.label[offset] != ltr:
+                    return None
+                offset += 1
+            else:
+                node = node.child(ltr)
+                if node is None:
+                    return None
+                offset = 1
+        return node, offset
+
+    def nodeCount(self):
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.iterChildren())
+        return count
+
+    def stats(self):
+        '''returns the number of nodes, the mean and largest number of items
+           in a node and an estimate of the bytes the nodes and their
+           posting lists take, not counting the items themselves. The
+           nodes of a snapshot that were not used yet get decoded.'''
+        nodes = 0
+        postings = 0
+        largest = 0
+        size = 0
+        getsizeof = sys.getsizeof
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            items = node.items
+            postings += len(items)
+            largest = max(largest, len(items))
+            size += getsizeof(node) + getsizeof(node.label) + \
+                    getsizeof(node.children) + getsizeof(items) + \
+                    getsizeof(items.typed) + getsizeof(items.bitmap) + \
+                    getsizeof(items.bitmap.containers)
+            for ranks in items.typed.itervalues():
+                size += getsizeof(ranks) + getsizeof(ranks.chunks) + \
+                        getsizeof(ranks.maxes) + \
+                        sum([getsizeof(chunk) for chunk in ranks.chunks])
+            for container in items.bitmap.containers.itervalues():
+                if type(container) is list:
+                    size += getsizeof(container) + getsizeof(container[0])
+                else:
+                    size += getsizeof(container)
+            stack.extend(node.iterChildren())
+        return {'nodes': nodes, 'itemsPerNode': float(postings) / nodes,
+                'largestNode': largest, 'bytes': size}
+
 class ManageTopItems(object):
         '''Makes sure that the first n elements are kept in the heap,
            where n represents the number of results required from the query
@@ -112,117 +977,1627 @@ class ManageTopItems(object):
             heapq.heapify(iterable)
             self.heap = iterable
 
-class MainHandler(object):
-    '''Handles the commands passed in as input
+class ColumnStore(object):
+    '''The scores, types and insertionIDs of the items, each in a NumPy
+       array indexed by the items' ordinals, for the queries that have to
+       score every match. The type boosts of a WQUERY are applied to all
+       the matches by a single multiply with the factors of their types,
+       the few id boosts are applied one by one, and the top results are
+       picked by argpartition and sorted by lexsort instead of pushing
+       every match through a heap of tuples.
+
+       The slots of deleted items keep their old values, since no query
+       matches them.
+
+       Attributes:
+         scores: float64 array of the scores
+         typeCodes: int8 array of the positions of the types in types, or
+         len(types) for any other type
+         insertionIDs: int64 array of the insertionIDs
+    '''
+    types = ['user','topic','question','board']
+
+    def __init__(self, capacity=1024):
+        self.scores = numpy.zeros(capacity, numpy.float64)
+        self.typeCodes = numpy.zeros(capacity, numpy.int8)
+        self.insertionIDs = numpy.zeros(capacity, numpy.int64)
+
+    @classmethod
+    def fromItems(cls, ordinals):
+        '''builds the store out of a list of the items by ordinal, with
+           None for the free ordinals'''
+        columns = cls(max(len(ordinals), 1))
+        for item in ordinals:
+            if item is not None:
+                columns.put(item)
+        return columns
+
+    def put(self, item):
+        ordinal = item.ordinal
+        if ordinal >= len(self.scores):
+            capacity = max(ordinal + 1, 2 * len(self.scores))
+            for name in ('scores', 'typeCodes', 'insertionIDs'):
+                column = getattr(self, name)
+                grown = numpy.zeros(capacity, column.dtype)
+                grown[:len(column)] = column
+                setattr(self, name, grown)
+        self.scores[ordinal] = item.score
+        try:
+            self.typeCodes[ordinal] = self.types.index(item.type)
+        except ValueError:
+            self.typeCodes[ordinal] = len(self.types)
+        self.insertionIDs[ordinal] = item.insertionID
+
+    @staticmethod
+    def ordinalsOf(bitmap):
+        '''returns the ordinals of a Bitmap as an ascending int64 array'''
+        parts = []
+        for high in sorted(bitmap.containers):
+            container = bitmap.containers[high]
+            if type(container) is list:
+                #the bits of a byte go from the lowest up, unlike unpackbits
+                bits = numpy.unpackbits(numpy.frombuffer(container[0],
+                                                         numpy.uint8))
+                lows = numpy.flatnonzero(bits.reshape(-1, 8)[:, ::-1])
+            else:
+                lows = numpy.frombuffer(container, numpy.uint16)
+            parts.append(lows.astype(numpy.int64) + (high << 16))
+        if not parts:
+            return numpy.zeros(0, numpy.int64)
+        return numpy.concatenate(parts)
+
+    def top(self, ordinals, numOfResults, typeBoosts, idOrdinals, after=None):
+        '''returns the (boosted score, insertionID, ordinal) tuples of the
+           best numOfResults of the ascending ordinals, best first, where
+           idOrdinals maps the ordinals with an id boost to it, leaving out
+           the ones that rank before a (boosted score, insertionID) pair
+           after, if given'''
+        scores = self.scores[ordinals]
+        if typeBoosts:
+            factors = numpy.ones(len(self.types) + 1)
+            for (type_, boost) in typeBoosts.iteritems():
+                factors[self.types.index(type_)] = boost
+            scores *= factors[self.typeCodes[ordinals]]
+        for (ordinal, boost) in idOrdinals.iteritems():
+            i = numpy.searchsorted(ordinals, ordinal)
+            if i < len(ordinals) and ordinals[i] == ordinal:
+                scores[i] *= boost
+        insertionIDs = self.insertionIDs[ordinals]
+        if after is not None:
+            keep = numpy.flatnonzero((scores < after[0]) |
+                                     ((scores == after[0]) &
+                                      (insertionIDs < after[1])))
+            scores = scores[keep]
+            insertionIDs = insertionIDs[keep]
+            ordinals = ordinals[keep]
+        if numOfResults < len(scores):
+            best = numpy.argpartition(-scores, numOfResults - 1)
+            kth = scores[best[:numOfResults]].min()
+            #every item tied with the k-th score is kept, so that the
+            #insertionIDs decide between them
+            keep = numpy.flatnonzero(scores >= kth)
+            scores = scores[keep]
+            insertionIDs = insertionIDs[keep]
+            ordinals = ordinals[keep]
+        order = numpy.lexsort((-insertionIDs, -scores))[:numOfResults]
+        return zip(scores[order].tolist(), insertionIDs[order].tolist(),
+                   ordinals[order].tolist())
+
+def wordPrefixes(words):
+    '''the set of the non-empty prefixes of the words, which are the query
+       tokens that an item with the words matches'''
+    prefixes = set()
+    for word in set(words):
+        for i in xrange(1, len(word) + 1):
+            prefixes.add(word[:i])
+    return prefixes
+
+class QueryCache(object):
+    '''A bounded LRU cache of query results.
+
+       A query only depends on the items that match all of its tokens, so
+       when an item is added or deleted only the entries whose every token
+       is a prefix of one of the item's words are dropped.
+
+       Attributes:
+         capacity: the most entries kept; 0 turns the cache off
+         entries: maps a key to its result, least recently used first
+         byToken: maps a query token to the keys of the entries that have it
+         hits, misses, evictions, invalidations: counters of the lookups
+         that were answered, the ones that were not, the entries dropped to
+         stay within capacity and the ones dropped by add or delete
+    '''
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.byToken = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, boosts, numOfResults, queryTokens):
+        '''the order and repetition of the tokens do not change a query'''
+        return (tuple(sorted(set(queryTokens))), tuple(sorted(boosts.items())),
+                numOfResults)
+
+    def get(self, key):
+        try:
+            result = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = result
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if not self.capacity:
+            return
+        if key not in self.entries:
+            for token in key[0]:
+                self.byToken.setdefault(token, set()).add(key)
+        self.entries[key] = result
+        while len(self.entries) > self.capacity:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        del self.entries[key]
+        for token in key[0]:
+            keys = self.byToken[token]
+            keys.discard(key)
+            if not keys:
+                del self.byToken[token]
+
+    def invalidate(self, words):
+        '''drops the entries that an item with the given words matches'''
+        if not self.entries:
+            return
+        prefixes = wordPrefixes(words)
+        stale = set()
+        for prefix in prefixes:
+            for key in self.byToken.get(prefix, ()):
+                if key not in stale and \
+                   all([token in prefixes for token in key[0]]):
+                    stale.add(key)
+        for key in stale:
+            self._drop(key)
+        self.invalidations += len(stale)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+class StandingQuery(object):
+    '''A query whose results are kept current as items are added and
+       deleted, for the dashboards that poll the same query all the time.
+
+       ranks holds the (-boosted score, -insertionID, item) ranks of the
+       top numOfResults matches in order. An added item that matches the
+       tokens is ranked in and pushes out the last rank once there are
+       more than numOfResults. A deleted item that was in the ranks leaves
+       a gap that only the index can fill when the ranks were full, as the
+       next best match was never kept, so then the ranks are marked stale
+       and recomputed by the next read. Otherwise reading the results
+       costs O(numOfResults) at most, however large the index. An item
+       whose score is UPDATEd moves within the ranks, and only leaves a
+       gap to refill when it drops below the rest of full ranks.
+
+       Attributes:
+         boosts, numOfResults, queryTokens: the query, as given to _query
+         tokens: the distinct tokens of the query
+         typeBoosts, idBoosts: the boosts of the types and of the ids
+         ranks: the ranks of the results, or None when stale
+         result: the result line of ranks, or None until it is next read
+    '''
+    def __init__(self, boosts, numOfResults, queryTokens):
+        self.boosts = boosts
+        self.numOfResults = max(numOfResults, 0)
+        self.queryTokens = queryTokens
+        self.tokens = set(queryTokens)
+        self.typeBoosts, self.idBoosts, _ = IndexReader.splitBoosts(boosts)
+        self.ranks = None
+        self.result = None
+
+    def stale(self):
+        '''makes the next read recompute the ranks'''
+        self.ranks = None
+        self.result = None
+
+    def rank(self, item, score=None):
+        '''the rank of the item in the results, with its score or the
+           given one'''
+        if score is None:
+            score = item.score
+        score *= self.typeBoosts.get(item.type, 1.0)
+        if item.id in self.idBoosts:
+            score *= self.idBoosts[item.id]
+        return (-score, -item.insertionID, item)
+
+    def added(self, item, prefixes):
+        '''ranks in an item added with the given wordPrefixes'''
+        ranks = self.ranks
+        if ranks is None or not self.tokens <= prefixes:
+            return
+        rank = self.rank(item)
+        if len(ranks) == self.numOfResults:
+            if not ranks or rank >= ranks[-1]:
+                return
+            ranks.pop()
+        ranks.insert(bisect_left(ranks, rank), rank)
+        self.result = None
+
+    def deleted(self, item, prefixes):
+        '''drops an item that was deleted with the given wordPrefixes'''
+        ranks = self.ranks
+        if ranks is None or not self.tokens <= prefixes:
+            return
+        rank = self.rank(item)
+        i = bisect_left(ranks, rank)
+        if i == len(ranks) or ranks[i][2] is not item:
+            return
+        if len(ranks) == self.numOfResults:
+            self.stale()
+        else:
+            del ranks[i]
+            self.result = None
+
+    def rescored(self, item, score, prefixes):
+        '''moves an item with the given wordPrefixes whose score used to
+           be score'''
+        ranks = self.ranks
+        if ranks is None or not self.tokens <= prefixes:
+            return
+        old = self.rank(item, score)
+        i = bisect_left(ranks, old)
+        if i == len(ranks) or ranks[i][2] is not item:
+            self.added(item, prefixes)
+            return
+        del ranks[i]
+        self.result = None
+        rank = self.rank(item)
+        #the matches left out rank below the old last rank, so the item
+        #still belongs in full ranks if it rose, or stayed above the rest
+        if len(ranks) + 1 == self.numOfResults and rank > old and \
+           (not ranks or rank > ranks[-1]):
+            self.stale()
+            return
+        ranks.insert(bisect_left(ranks, rank), rank)
+
+    def read(self, handler):
+        '''returns the result line, recomputing the ranks if stale'''
+        if self.ranks is None:
+            self.ranks = [(-score, -insertionID, item) for
+                          (score, insertionID, item) in handler._topRanks(
+                              self.boosts, self.numOfResults,
+                              self.queryTokens)]
+        if self.result is None:
+            self.result = " ".join([rank[2].id for rank in self.ranks])
+        return self.result
+
+class Histogram(object):
+    '''Counts values in buckets whose bounds double from one to the
+       next, so recording a value is a bisect and an increment. The
+       percentiles are read off the counts, assuming the values of a
+       bucket are spread evenly over it.
+
+       Attributes:
+         bounds: the upper bound of every bucket but the last, unbounded one
+         counts: the number of values in every bucket
+         count, total, largest: the number, sum and largest of the values
+    '''
+    def __init__(self, smallest, numOfBuckets=32):
+        self.bounds = [smallest * 2 ** i for i in range(numOfBuckets - 1)]
+        self.counts = [0] * numOfBuckets
+        self.count = 0
+        self.total = 0
+        self.largest = 0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.largest:
+            self.largest = value
+
+    def percentile(self, p):
+        '''the value at fraction p of the way through the values'''
+        if not self.count:
+            return 0
+        rank = p * self.count
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i else 0
+                upper = self.bounds[i] if i < len(self.bounds) else \
+                        self.largest
+                upper = min(upper, self.largest)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.largest
+
+    def summary(self, scale=1):
+        return {'count': self.count,
+                'mean': float(self.total) * scale / self.count
+                        if self.count else 0,
+                'p50': self.percentile(0.5) * scale,
+                'p95': self.percentile(0.95) * scale,
+                'p99': self.percentile(0.99) * scale,
+                'max': self.largest * scale}
+
+class Metrics(object):
+    '''The counters and histograms of a MainHandler, cheap enough to
+       always keep: a command costs two clock reads and a Histogram
+       record, and a query two more records.
+
+       Attributes:
+         latencies: maps a command to the Histogram of its run times in
+         seconds, whose count is the number of times it ran
+         candidates: Histogram of the number of items that matched every
+         token of a query, i.e. the candidates left after intersecting, or
+         the size of the rarest token's items when the query was probed
+         heapSizes: Histogram of the sizes the ManageTopItems heaps of the
+         queries that scored every match reached
+         profileEvery: profiles every profileEvery-th query, 0 for none
+         profiler: the cProfile.Profile the sampled queries run under
+         queries: the number of queries so far, to pick the samples
     '''
     def __init__(self):
+        self.latencies = {}
+        self.candidates = Histogram(1)
+        self.heapSizes = Histogram(1)
+        self.profileEvery = 0
+        self.profiler = None
+        self.queries = 0
+
+    def recordCommand(self, command, seconds):
+        try:
+            self.latencies[command].record(seconds)
+        except KeyError:
+            histogram = self.latencies[command] = Histogram(1e-6)
+            histogram.record(seconds)
+
+    def setProfiling(self, every):
+        '''profiles one query out of every, or none for 0, starting over
+           from an empty profile'''
+        self.profileEvery = every
+        self.profiler = cProfile.Profile() if every else None
+
+    def sample(self):
+        '''returns the profiler if the query about to run is to be
+           profiled, and None otherwise'''
+        if not self.profileEvery:
+            return None
+        self.queries += 1
+        if self.queries % self.profileEvery:
+            return None
+        return self.profiler
+
+    def profile(self, limit=10):
+        '''the functions the sampled queries spent the most time in, as
+           [function, calls, own seconds, cumulative seconds] lists'''
+        if self.profiler is None:
+            return []
+        try:
+            stats = pstats.Stats(self.profiler).stats
+        except TypeError:
+            #nothing was sampled yet
+            return []
+        rows = []
+        for ((path, line, name), (_, calls, own, cumulative, _)) in \
+            stats.iteritems():
+            rows.append(['%s:%d(%s)' % (os.path.basename(path), line, name),
+                         calls, own, cumulative])
+        rows.sort(key=lambda row: -row[3])
+        return rows[:limit]
+
+    def summary(self):
+        return {'commands': dict([(command, histogram.summary(1000))
+                                  for (command, histogram)
+                                  in self.latencies.iteritems()]),
+                'candidates': self.candidates.summary(),
+                'heapSizes': self.heapSizes.summary(),
+                'profileEvery': self.profileEvery,
+                'profile': self.profile()}
+
+class QuerySession(object):
+    '''Keeps what the previous query of a typeahead client found, so that
+       the next keystroke can start from there.
+
+       Every token remembers the position it reached in the trie, and a
+       token that extends a token of the previous query descends from that
+       position over the new characters only. When each previous token is
+       still there or got extended, the new matches are a subset of the
+       previous ones, so the previous Bitmap of matches is narrowed by the
+       tokens that changed instead of intersecting every token again.
+       Any add or delete in between invalidates the remembered state.
+
+       Attributes:
+         handler: the MainHandler queried
+         generation: the generation of the handler the state belongs to
+         positions: maps each token of the previous query to its trie
+         position, or None if no item has the token
+         matched: Bitmap of the items matching the previous query
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.generation = None
+        self.positions = {}
+        self.matched = None
+
+    def query(self, commandData):
+        '''returns the result of a QUERY'''
+        return self._query(*self.handler.parseQuery(commandData))
+
+    def wquery(self, commandData):
+        '''returns the result of a WQUERY'''
+        return self._query(*self.handler.parseWquery(commandData))
+
+    def _query(self, boosts, numOfResults, queryTokens):
+        handler = self.handler
+        trie = handler.trie
+        if self.generation != handler.generation:
+            self.generation = handler.generation
+            self.positions = {}
+            self.matched = None
+        previous = self.positions
+        positions = {}
+        changed = []
+        for token in set(queryTokens):
+            if token in previous:
+                positions[token] = previous[token]
+                continue
+            base = ""
+            for old in previous:
+                if token.startswith(old) and len(old) > len(base):
+                    base = old
+            if base:
+                position = previous[base]
+                if position is not None:
+                    position = trie.descend(position[0], position[1],
+                                            token[len(base):])
+            else:
+                position = trie.descend(trie.root, 0, token)
+            positions[token] = position
+            changed.append(token)
+
+        driver = None
+        for (token, position) in positions.iteritems():
+            if position is None or not token:
+                driver = PostingList()
+                break
+            items = position[0].items
+            if driver is None or len(items) < len(driver):
+                driver = items
+        if driver is None:
+            driver = PostingList()
+
+        narrowing = self.matched is not None and \
+                    all([any([token.startswith(old) for token in positions])
+                         for old in previous])
+        if not driver or len(positions) == 1:
+            matched = driver.bitmap
+        else:
+            if narrowing:
+                matched = self.matched
+                check = changed
+            else:
+                matched = None
+                check = positions.keys()
+            for token in check:
+                bitmap = positions[token][0].items.bitmap
+                matched = bitmap if matched is None else matched & bitmap
+        self.positions = positions
+        self.matched = matched
+
+        candidates = (driver, matched if len(positions) > 1 else None)
+        return handler._evaluate(boosts, numOfResults, queryTokens,
+                                 candidates)
+
+class QueryBatch(object):
+    '''Evaluates a run of queries with no add or delete in between
+       together, as the index cannot change while they run.
+
+       Every token is looked up in the trie once for the whole batch, and
+       the intersections of the rarest tokens of a query are kept for the
+       queries that share them, see IndexReader._candidates. The queries
+       with the same tokens and boosts are answered by a single walk of
+       their matches for the largest number of results any of them asks
+       for, since the results of a smaller one are the first ones of it.
+       The ones with the same tokens that have to score every match, for
+       different boosts, are scored together in a single walk as well.
+
+       Attributes:
+         handler: the MainHandler queried
+         postings: maps a token to its PostingList
+         intersections: maps a tuple of tokens, rarest first, to the Bitmap
+         of the items that match all of them
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.postings = {}
+        self.intersections = {}
+
+    def isPrefix(self, token):
+        try:
+            return self.postings[token]
+        except KeyError:
+            postings = self.postings[token] = self.handler.trie.isPrefix(token)
+            return postings
+
+    def run(self, queries):
+        '''returns the result lines of the (boosts, numOfResults,
+           queryTokens) of the queries, in order, going through the query
+           cache of the handler'''
+        handler = self.handler
+        cache = handler.cache
+        results = [None] * len(queries)
+        #maps the tokens and boosts of a cache key to the largest number of
+        #results asked for and the queries asking
+        groups = OrderedDict()
+        keys = []
+        for (i, (boosts, numOfResults, queryTokens)) in enumerate(queries):
+            key = cache.key(boosts, numOfResults, queryTokens)
+            keys.append(key)
+            results[i] = cache.get(key)
+            if results[i] is None:
+                group = groups.setdefault(key[:2], [0, []])
+                group[0] = max(group[0], numOfResults)
+                group[1].append(i)
+        #the groups with the same tokens that score every match share a
+        #single walk of the matches, unless the ColumnStore scores them
+        scoring = OrderedDict()
+        if handler.columns is None:
+            for (key, (numOfResults, _)) in groups.iteritems():
+                typeBoosts, idBoosts, scoreAll = \
+                    handler.splitBoosts(dict(key[1]))
+                if scoreAll:
+                    scoring.setdefault(key[0], []).append(
+                        (key, (typeBoosts, idBoosts, numOfResults)))
+        ranksOf = {}
+        for (tokens, shared) in scoring.iteritems():
+            if len(shared) < 2:
+                continue
+            candidates = handler._candidates(tokens, None, self)
+            for _ in shared:
+                handler._recordCandidates(candidates)
+            ranks = handler._scoreAll(candidates,
+                                      [query for (_, query) in shared])
+            for ((key, _), ranks) in zip(shared, ranks):
+                ranksOf[key] = ranks
+        for (key, (numOfResults, members)) in groups.iteritems():
+            ranks = ranksOf.get(key)
+            if ranks is None:
+                ranks = handler._topRanks(dict(key[1]), numOfResults, key[0],
+                                          batch=self)
+            ids = [item.id for (_, _, item) in ranks]
+            for i in members:
+                results[i] = " ".join(ids[:max(queries[i][1], 0)])
+                cache.put(keys[i], results[i])
+        return results
+
+class IndexReader(object):
+    '''Evaluates queries against self.trie and self.items, which is all a
+       query reads, so that MainHandler and the read-only versions of
+       versioned_search share the same code. The sizes of the queries are
+       recorded in self.metrics, if it is not None.
+    '''
+    metrics = None
+    #the ColumnStore of the items, if any
+    columns = None
+    #from this many results on, a WQUERY scores every match with the
+    #ColumnStore rather than merging the matches best first
+    largeInputSize = 1000
+    #the cost of testing an ordinal against a Bitmap, relative to the cost
+    #per ordinal of intersecting two Bitmaps
+    probeCost = 8
+    #the number of the rarest token's items probed to plan a query
+    sampleSize = 32
+
+    def _candidates(self, queryTokens, numOfResults=None, batch=None):
+        '''plans the query, returning the shortest posting list among its
+           tokens, which every match is part of, along with what the other
+           tokens narrow it down to: None for a single token, and otherwise
+           either the Bitmap of the items that match every token or a
+           Conjunction that tests the items one at a time.
+
+           A repeated token, or one that is a prefix of another token,
+           matches every item that the other one does, so it is dropped.
+           The number of items of every remaining token is read off its
+           node, as every Bitmap keeps its size up to date.
+
+           When only the first numOfResults matches are needed, the rarest
+           token's list is walked best first until that many of its items
+           match the other tokens. The share of its items that do is
+           estimated by probing a sample of them, since words that go
+           together are far from independent. About numOfResults / share
+           items get walked, and probing the other tokens for each of those
+           is cheaper than intersecting their Bitmaps when those are large.
+
+           The queries of a QueryBatch share the posting lists of their
+           tokens and the intersections of their rarest tokens through the
+           batch.
+        '''
+        tokens = sorted(set(queryTokens))
+        if not tokens or not tokens[0]:
+            #an empty token, left by a doubled space, matches no item
+            return PostingList(), None
+        isPrefix = self.trie.isPrefix if batch is None else batch.isPrefix
+        #the tokens starting with a token come right after it in order,
+        #and the rest are planned rarest first
+        plan = sorted([(len(postings), token, postings) for (token, postings)
+                       in [(token, isPrefix(token)) for (i, token)
+                           in enumerate(tokens) if i + 1 == len(tokens) or
+                           not tokens[i + 1].startswith(token)]])
+        tokens = [token for (_, token, _) in plan]
+        postings = [postings for (_, _, postings) in plan]
+        driver = postings[0]
+        if len(postings) == 1 or not driver:
+            return driver, None
+        others = postings[1:]
+        if batch is not None and tuple(tokens) in batch.intersections:
+            return driver, batch.intersections[tuple(tokens)]
+        if numOfResults is not None:
+            conjunction = Conjunction([other.bitmap for other in others] +
+                                      [driver.bitmap])
+            sample = list(islice(driver.bitmap, self.sampleSize))
+            hits = len([ordinal for ordinal in sample
+                        if ordinal in conjunction])
+            if hits:
+                walked = min(len(driver),
+                             numOfResults * len(sample) / float(hits))
+                work = sum([min(len(driver), len(other)) for other in others])
+                if walked * len(others) * self.probeCost < work:
+                    return driver, conjunction
+        matched = driver.bitmap
+        for i in xrange(1, len(postings)):
+            if not matched:
+                break
+            if batch is None:
+                matched = matched & postings[i].bitmap
+                continue
+            key = tuple(tokens[:i + 1])
+            if key not in batch.intersections:
+                batch.intersections[key] = matched & postings[i].bitmap
+            matched = batch.intersections[key]
+        return driver, matched
+
+    def _matches(self, candidates):
+        '''yields the items that match every token of the query, best first,
+           given the _candidates of the query.
+
+           The shortest posting list is walked best first and only the
+           items whose ordinal is in the intersection of the tokens, or
+           passes the probes of a Conjunction, are yielded, so a caller that
+           stops after k items never looks past the k-th match.
+        '''
+        driver, matched = candidates
+        if matched is None:
+            for item in driver:
+                yield item
+            return
+        remaining = len(matched)
+        for item in driver:
+            if not remaining:
+                return
+            if item.ordinal in matched:
+                remaining -= 1
+                yield item
+
+    def _boostedMatches(self, candidates, typeBoosts, idBoosts, after=None):
+        '''yields the (-boosted score, -insertionID, item) ranks of the
+           items that match every token of the query, best first, given the
+           _candidates of the query, starting after the (-boosted score,
+           -insertionID) pair after if given.
+
+           A positive type boost keeps the order within the type, so the
+           typed lists of the shortest posting list are merged with their
+           boosts applied on the fly. The few items with an id boost are
+           left out of those streams and merged back in as one extra,
+           presorted stream.
+        '''
+        driver, matched = candidates
+        if matched is None:
+            matched = driver.bitmap
+        if not matched:
+            return
+        streams = []
+        for (type_, ranks) in driver.typed.iteritems():
+            boost = typeBoosts.get(type_, 1.0)
+            if after is not None:
+                ranks = ranks.after(after, boost)
+            streams.append(boostedRanks(ranks, boost, matched, idBoosts))
+        boostedItems = []
+        for (id_, boost) in idBoosts.iteritems():
+            item = self.items.get(id_)
+            if item is not None and item.ordinal in matched:
+                score = item.score * typeBoosts.get(item.type, 1.0) * boost
+                rank = (-score, -item.insertionID, item)
+                if after is None or rank[:2] > after:
+                    boostedItems.append(rank)
+        boostedItems.sort()
+        streams.append(boostedItems)
+        for rank in islice(mergeRanks(streams), len(matched)):
+            yield rank
+
+    def _evaluate(self, boosts, numOfResults, queryTokens, candidates=None):
+        '''returns the ids of the items that match the words in the query
+           string, upto a certain number -- numOfResult'''
+        results = self._topRanks(boosts, numOfResults, queryTokens, candidates)
+        return " ".join([item.id for (_, _, item) in results])
+
+    def _topRanks(self, boosts, numOfResults, queryTokens, candidates=None,
+                  batch=None):
+        '''returns the (boosted score, insertionID, item) tuples of the
+           items that match the words in the query string, best first, upto
+           a certain number -- numOfResult'''
+        numOfResults = max(numOfResults, 0)
+        typeBoosts, idBoosts, scoreAll = self.splitBoosts(boosts)
+        vectorize = self.columns is not None and numOfResults > 0 and \
+                    bool(boosts) and \
+                    (scoreAll or numOfResults >= self.largeInputSize)
+
+        if candidates is None:
+            candidates = self._candidates(queryTokens, None if scoreAll or
+                                          vectorize else numOfResults, batch)
+        self._recordCandidates(candidates)
+
+        if vectorize:
+            return self._columnTop(candidates, numOfResults, typeBoosts,
+                                   idBoosts)
+
+        if not boosts:
+            #the matches already come out in result order
+            results = islice(self._matches(candidates), numOfResults)
+            return [(item.score, item.insertionID, item) for item in results]
+
+        if not scoreAll:
+            ranks = self._boostedMatches(candidates, typeBoosts, idBoosts)
+            return [(-score, -insertionID, item) for (score, insertionID, item)
+                    in islice(ranks, numOfResults)]
+
+        return self._scoreAll(candidates,
+                              [(typeBoosts, idBoosts, numOfResults)])[0]
+
+    def _columnTop(self, candidates, numOfResults, typeBoosts, idBoosts,
+                   after=None):
+        '''scores the matches with the ColumnStore, see ColumnStore.top'''
+        driver, matched = candidates
+        if matched is None:
+            matched = driver.bitmap
+        idOrdinals = {}
+        for (id_, boost) in idBoosts.iteritems():
+            item = self.items.get(id_)
+            if item is not None:
+                idOrdinals[item.ordinal] = boost
+        ordinals = self.ordinals
+        return [(score, insertionID, ordinals[ordinal]) for
+                (score, insertionID, ordinal) in self.columns.top(
+                    ColumnStore.ordinalsOf(matched), numOfResults,
+                    typeBoosts, idOrdinals, after)]
+
+    @staticmethod
+    def splitBoosts(boosts):
+        '''returns the boosts of the types and of the ids, and whether every
+           match has to be scored'''
+        types = ['user','topic','question','board']
+        typeBoosts = {}
+        idBoosts = {}
+        for (affected, boost) in boosts.iteritems():
+            if affected in types:
+                typeBoosts[affected] = boost
+            else: #an id is specified
+                idBoosts[affected] = boost
+        #a type boost that is not positive reorders the items of its type,
+        #so every match has to be scored
+        return typeBoosts, idBoosts, min(typeBoosts.values() or [1.0]) <= 0
+
+    def _recordCandidates(self, candidates):
+        if self.metrics is not None:
+            driver, matched = candidates
+            self.metrics.candidates.record(len(driver if matched is None
+                                               else matched))
+
+    def _scoreAll(self, candidates, queries, after=None):
+        '''scores every match for each of the (typeBoosts, idBoosts,
+           numOfResults) of queries with the same tokens in a single walk of
+           the matches, returning the lists of their top (boosted score,
+           insertionID, item) tuples, best first, leaving out the ones that
+           rank before a (boosted score, insertionID) pair after, if given'''
+        #the items are ranked by (boosted score, insertionID) tuples, so no
+        #item ever has to be copied to carry its boosted score
+        heaps = [(ManageTopItems(numOfResults), typeBoosts, idBoosts)
+                 for (typeBoosts, idBoosts, numOfResults) in queries]
+        for item in self._matches(candidates):
+            for (heapHandler, typeBoosts, idBoosts) in heaps:
+                score = item.score * typeBoosts.get(item.type, 1.0)
+                if item.id in idBoosts:
+                    score *= idBoosts[item.id]
+                if after is not None and (score, item.insertionID) >= after:
+                    continue
+                heapHandler.push((score, item.insertionID, item))
+        results = []
+        for (heapHandler, _, _) in heaps:
+            if self.metrics is not None:
+                self.metrics.heapSizes.record(len(heapHandler.heap))
+            numOfResults = heapHandler.numOfResults
+            if numOfResults < self.largeInputSize:
+                results.append(heapq.nlargest(numOfResults, heapHandler.heap))
+            else:
+                results.append(sorted(heapHandler.heap,
+                                      reverse=True)[:numOfResults])
+        return results
+
+class MainHandler(IndexReader):
+    '''Handles the commands passed in as input
+    '''
+    #the most streams of paged queries kept to continue from, see page
+    pageCapacity = 64
+    #boosted score, insertionID and generation of a cursor
+    cursorFormat = struct.Struct('<dqq')
+
+    def __init__(self, cacheSize=1024):
         self.items = {}
         self.trie = Trie()
+        self.cache = QueryCache(cacheSize)
+        #ordinal -> Item, with None in the slots of deleted items
+        self.ordinals = []
+        #heap of the free slots, so the smallest ordinals are reused first
+        #and the bitmaps stay dense
+        self.freeOrdinals = []
+        #the insertionID of the next item ADDed through execute
+        self.inserted = 0
+        #bumped by every add and delete, so state derived from the index can
+        #tell when it has gone stale
+        self.generation = 0
+        self.metrics = Metrics()
+        if numpy is not None:
+            self.columns = ColumnStore()
+        #maps the name of a standing query to its StandingQuery
+        self.standing = {}
+        #maps the tokens and boosts of a paged query and the cursor of its
+        #next page to the ranks and stream of matches it continues from,
+        #least recently used first
+        self.pages = OrderedDict()
         
     def add(self, commandData, insertionID):
         '''ADD <type> <id> <score> <data string that contain spaces>'''
         [type_,id_,score,dataStr] = commandData.split(" ",3)
+        #a malformed command raises before it takes an ordinal
         item = Item(type_,id_,score,dataStr,insertionID)
-        self.items[id_] = item
-        self.trie.insert(dataStr.lower().split(), item)
+        self._placeItem(item)
+        words = dataStr.lower().split()
+        self.trie.insert(words, item)
+        self.cache.invalidate(words)
+        if self.standing:
+            prefixes = wordPrefixes(words)
+            for standing in self.standing.itervalues():
+                standing.added(item, prefixes)
+        self.generation += 1
+        
+    def bulkAdd(self, commands):
+        '''ADDs a batch of items, given as the data of their ADD commands,
+           with insertionIDs continuing from self.inserted. Instead of
+           walking the trie for every word of every item, the whole trie is
+           rebuilt from the sorted words of all the items by Trie.build,
+           which pays off for initial loads and large reindexes.
+        '''
+        #every command is parsed before any item is placed, so a malformed
+        #one leaves the index as it was
+        items = []
+        for commandData in commands:
+            [type_,id_,score,dataStr] = commandData.split(" ",3)
+            items.append(Item(type_,id_,score,dataStr,
+                              self.inserted + len(items)))
+        self.inserted += len(items)
+        for item in items:
+            self._placeItem(item)
+        self.trie = Trie.build(self.items.itervalues())
+        self.cache = QueryCache(self.cache.capacity)
+        for standing in self.standing.itervalues():
+            standing.stale()
+        self.generation += 1
         
+    def _placeItem(self, item):
+        '''gives a new item the smallest free ordinal and puts it in the
+           maps of the items, but not in the trie'''
+        if self.freeOrdinals:
+            ordinal = heapq.heappop(self.freeOrdinals)
+        else:
+            ordinal = len(self.ordinals)
+            self.ordinals.append(None)
+        item.ordinal = ordinal
+        self.ordinals[ordinal] = item
+        self.items[item.id] = item
+        if self.columns is not None:
+            self.columns.put(item)
+
     def delete(self, commandData):
         '''DEL <id>'''
         itemID = commandData
         item = self.items.pop(itemID, None)
-        self.trie.remove(item.dataStr.lower().split(), item)
+        words = item.dataStr.lower().split()
+        self.trie.remove(words, item)
+        self.cache.invalidate(words)
+        if self.standing:
+            prefixes = wordPrefixes(words)
+            for standing in self.standing.itervalues():
+                standing.deleted(item, prefixes)
+        self.generation += 1
+        self.ordinals[item.ordinal] = None
+        heapq.heappush(self.freeOrdinals, item.ordinal)
         
+    def update(self, commandData):
+        '''UPDATE <id> <score>
+
+           changes the score of an item in place. It keeps its
+           insertionID, so it keeps its place among the items of the same
+           score, and its ordinal, so no Bitmap changes. Its rank is moved
+           within the RankedLists of the nodes of its words by
+           Trie.rescore, and the cached results and standing queries its
+           words match are updated like for an add.'''
+        [itemID, score] = commandData.split()
+        item = self.items[itemID]
+        old = item.rank
+        oldScore = item.score
+        score = float(score)
+        new = (-score, -item.insertionID, item)
+        words = item.dataStr.lower().split()
+        self.trie.rescore(words, item, old, new)
+        item.score = score
+        item.rank = new
+        if self.columns is not None:
+            self.columns.put(item)
+        self.cache.invalidate(words)
+        if self.standing:
+            prefixes = wordPrefixes(words)
+            for standing in self.standing.itervalues():
+                standing.rescored(item, oldScore, prefixes)
+        self.generation += 1
+
+    def page(self, cursor, boosts, numOfResults, queryTokens):
+        '''returns the result line of the next numOfResults results of a
+           query after the cursor, or of the first ones for the cursor '-',
+           led by the cursor of the page after it, or '-' if there is none.
+
+           A cursor holds the boosted score and insertionID of the last
+           result of its page and the generation of the index. The next
+           page is the results that rank after that pair in the index as it
+           is by then, so no result is returned twice or skipped, unless
+           it is added, deleted or UPDATEd in between. If the index did not
+           change, the page goes on with the merge of matches the previous
+           page stopped in, kept in self.pages. Otherwise the typed
+           RankedLists of the rarest token are bisected for the cursor, see
+           RankedList.after, and merged from there, so a page costs
+           O(numOfResults * log n) however deep it is. A WQUERY that has to
+           score every match scores them all again for every page, keeping
+           only the ones after the cursor.'''
+        numOfResults = max(numOfResults, 0)
+        query = self.cache.key(boosts, numOfResults, queryTokens)[:2]
+        after = None
+        pending = None
+        if cursor != '-':
+            try:
+                (score, insertionID, generation) = \
+                    self.cursorFormat.unpack(binascii.unhexlify(cursor))
+            except (TypeError, struct.error):
+                raise ValueError('not a cursor: %r' % cursor)
+            after = (-score, -insertionID)
+            if generation == self.generation:
+                pending = self.pages.pop((query, cursor), None)
+        if pending is None:
+            pending = self._firstRanks(boosts, numOfResults, queryTokens,
+                                       after)
+        (ranks, stream) = pending
+        if stream is not None:
+            ranks.extend(islice(stream, numOfResults + 1 - len(ranks)))
+        results = ranks[:numOfResults]
+        ids = [item.id for (_, _, item) in results]
+        if not results or len(ranks) == len(results):
+            return " ".join(['-'] + ids)
+        (score, insertionID, _) = results[-1]
+        cursor = binascii.hexlify(self.cursorFormat.pack(
+            -score, -insertionID, self.generation))
+        if stream is not None:
+            self.pages[(query, cursor)] = (ranks[numOfResults:], stream)
+            while len(self.pages) > self.pageCapacity:
+                self.pages.popitem(last=False)
+        return " ".join([cursor] + ids)
+
+    def _firstRanks(self, boosts, numOfResults, queryTokens, after):
+        '''returns the (-boosted score, -insertionID, item) ranks of at
+           least the first numOfResults + 1 matches after the pair after, or
+           of all of them if there are fewer, along with a stream of the
+           ones after those, or None if every match had to be scored'''
+        typeBoosts, idBoosts, scoreAll = self.splitBoosts(boosts)
+        candidates = self._candidates(queryTokens, None if scoreAll else
+                                      numOfResults + 1)
+        self._recordCandidates(candidates)
+        if not scoreAll:
+            return [], self._boostedMatches(candidates, typeBoosts, idBoosts,
+                                            after)
+        if after is not None:
+            after = (-after[0], -after[1])
+        if self.columns is not None:
+            ranks = self._columnTop(candidates, numOfResults + 1, typeBoosts,
+                                    idBoosts, after)
+        else:
+            ranks = self._scoreAll(candidates, [(typeBoosts, idBoosts,
+                                                 numOfResults + 1)], after)[0]
+        return [(-score, -insertionID, item)
+                for (score, insertionID, item) in ranks], None
+
+    def session(self):
+        '''returns a QuerySession for a typeahead client'''
+        return QuerySession(self)
+
+    def addStanding(self, name, boosts, numOfResults, queryTokens):
+        '''registers a StandingQuery under name, replacing any query of
+           that name, and returns its result line'''
+        standing = StandingQuery(boosts, numOfResults, queryTokens)
+        self.standing[name] = standing
+        return standing.read(self)
+
+    def readStanding(self, name):
+        '''returns the current result line of a standing query'''
+        return self.standing[name].read(self)
+
+    def deleteStanding(self, name):
+        del self.standing[name]
+
     def query(self, commandData):
         '''QUERY <number of results> <query string that can contain spaces>'''
-        [numOfResults, queryStr] = commandData.split(" ",1)
-        numOfResults = int(numOfResults)
-        queryTokens = queryStr.lower().split(" ")
-        
-        print self._query({}, numOfResults, queryTokens)
+        print self._query(*self.parseQuery(commandData))
         
     def wquery(self, commandData):
         '''WQUERY <number of results> <number of boosts>
                   (<type>:<boost>)* (<id>:<boost>)*
                   <query string that can contain spaces>'''
+        print self._query(*self.parseWquery(commandData))
+
+    @staticmethod
+    def parseQuery(commandData):
+        '''returns the arguments of _query for a QUERY'''
+        [numOfResults, queryStr] = commandData.split(" ",1)
+        numOfResults = int(numOfResults)
+        queryTokens = queryStr.lower().split(" ")
+        return {}, numOfResults, queryTokens
+
+    @staticmethod
+    def parseWquery(commandData):
+        '''returns the arguments of _query for a WQUERY'''
         [numOfResults, numOfBoosts, restOfQuery] = commandData.split(" ", 2)
         numOfResults = int(numOfResults)
         numOfBoosts = int(numOfBoosts)
         restOfQuery = restOfQuery.split(" ", numOfBoosts)
 
+        #a type or id that is boosted more than once gets the product
         boosts = {}
         for i in range(numOfBoosts):
             [affected,boost] = restOfQuery[i].split(":")
-            try:
-                boosts[affected] += [float(boost)]
-            except KeyError:
-                boosts[affected] = [float(boost)]
+            boosts[affected] = boosts.get(affected, 1.0) * float(boost)
                                                           
         queryStr = restOfQuery[-1]
         queryTokens = queryStr.lower().split(" ")
-        
-        print self._query(boosts, numOfResults, queryTokens)
+        return boosts, numOfResults, queryTokens
 
-    def _query(self, boosts, numOfResults, queryTokens):
-        '''prints the items that match the words in the query string, upto
-           a certain number -- numOfResult'''
-        types = ['user','topic','question','board']
+    def execute(self, line):
+        '''runs a single command line, returning the result line of a QUERY,
+           WQUERY or STATS and None for the other commands, and records how
+           long it took in self.metrics'''
+        start = time.time()
+        parts = line.strip().split(" ", 1)
+        command = parts[0]
+        commandData = parts[1] if len(parts) > 1 else ""
+        result = None
 
-        deepcopy = copy.deepcopy
-        isPrefix = self.trie.isPrefix 
-        valuesWithTokens = map(lambda x: isPrefix(x), queryTokens)
-        try:
-            values = reduce(lambda x,y: x & y, valuesWithTokens[1:],
-                                               valuesWithTokens[0])
-        except IndexError:
-            values = set()            
-
-        heapHandler = ManageTopItems(numOfResults)
-        if boosts:
-            for (i,value) in enumerate(values):
-                for bKey in boosts.keys():
-                    for boost in boosts[bKey]:
-                        if bKey in types:
-                            if value.type == bKey:
-                                value = deepcopy(value)
-                                value.score *= boost
-                        else: #an id is specified
-                            value = deepcopy(self.items[bKey])
-                            value.score *= boost
-                heapHandler.push(value)
+        if command == 'ADD':
+            self.add(commandData, self.inserted)
+            self.inserted += 1
+        elif command == 'DEL':
+            self.delete(commandData)
+        elif command == 'UPDATE':
+            self.update(commandData)
+        elif command == 'QUERY':
+            result = self._query(*self.parseQuery(commandData))
+        elif command == 'WQUERY':
+            result = self._query(*self.parseWquery(commandData))
+        elif command == 'SNAPSHOT':
+            [action, path] = commandData.split(" ", 1)
+            if action == 'SAVE':
+                self.saveSnapshot(path)
+            elif action == 'LOAD':
+                self.loadSnapshot(path)
+        elif command == 'STATS':
+            result = self.statsCommand(commandData)
+        elif command == 'STANDING':
+            result = self.standingCommand(commandData)
+        elif command == 'PAGE':
+            result = self.pageCommand(commandData)
+        self.metrics.recordCommand(command, time.time() - start)
+        return result
+
+    def standingCommand(self, commandData):
+        '''STANDING ADD <name> QUERY <QUERY data>
+           STANDING ADD <name> WQUERY <WQUERY data>
+           STANDING GET <name>
+           STANDING DEL <name>
+           ADD and GET return the result line of the standing query'''
+        [action, rest] = commandData.split(" ", 1)
+        if action == 'ADD':
+            [name, command, queryData] = rest.split(" ", 2)
+            if command == 'QUERY':
+                args = self.parseQuery(queryData)
+            else:
+                args = self.parseWquery(queryData)
+            return self.addStanding(name, *args)
+        elif action == 'GET':
+            return self.readStanding(rest)
+        elif action == 'DEL':
+            self.deleteStanding(rest)
+
+    def pageCommand(self, commandData):
+        '''PAGE <cursor> QUERY <QUERY data>
+           PAGE <cursor> WQUERY <WQUERY data>
+           returns the result line of a page of the query, whose number of
+           results is the page size: the cursor to pass to get the next
+           page, or '-' after the last one, followed by the ids. The cursor
+           of the first page is '-'.'''
+        [cursor, command, queryData] = commandData.split(" ", 2)
+        if command == 'QUERY':
+            args = self.parseQuery(queryData)
         else:
-            heapHandler.heapify(list(values))
-            
-        largeInputSize = 1000    
-        if numOfResults < largeInputSize:
-            results = heapq.nlargest(numOfResults, heapHandler.heap)
+            args = self.parseWquery(queryData)
+        return self.page(cursor, *args)
+
+    @staticmethod
+    def isQuery(line):
+        '''whether a command line is a QUERY or WQUERY, which only read
+           the index'''
+        return line.lstrip().split(" ", 1)[0] in ('QUERY', 'WQUERY')
+
+    def executeQueries(self, lines):
+        '''returns the result lines of a run of QUERY and WQUERY lines, in
+           order, evaluating them together as a QueryBatch. As nothing is
+           written, a run that fails part way can safely be run again.'''
+        start = time.time()
+        commands = []
+        queries = []
+        for line in lines:
+            [command, commandData] = line.strip().split(" ", 1)
+            commands.append(command)
+            if command == 'QUERY':
+                queries.append(self.parseQuery(commandData))
+            else:
+                queries.append(self.parseWquery(commandData))
+        results = QueryBatch(self).run(queries)
+        #the queries share the work, so they share the time too
+        seconds = (time.time() - start) / max(len(lines), 1)
+        for command in commands:
+            self.metrics.recordCommand(command, seconds)
+        return results
+
+    def executeAll(self, lines):
+        '''yields the result lines of the commands in order, running every
+           run of QUERY and WQUERY lines between other commands through
+           executeQueries'''
+        queries = []
+        for line in lines:
+            if self.isQuery(line):
+                queries.append(line)
+                continue
+            if queries:
+                for result in self.executeQueries(queries):
+                    yield result
+                queries = []
+            result = self.execute(line)
+            if result is not None:
+                yield result
+        if queries:
+            for result in self.executeQueries(queries):
+                yield result
+
+    def statsCommand(self, commandData):
+        '''STATS
+           STATS PROFILE <profile one query in this many, 0 for none>
+           STATS RESET
+           STATS on its own returns the stats as a line of JSON'''
+        action = commandData.split(" ")
+        if action[0] == 'PROFILE':
+            self.metrics.setProfiling(int(action[1]))
+        elif action[0] == 'RESET':
+            every = self.metrics.profileEvery
+            self.metrics = Metrics()
+            self.metrics.setProfiling(every)
         else:
-            results = sorted(heapHandler.heap,
-                             lambda x,y:-1*cmp(x,y))[:numOfResults]
-        return " ".join([item.id for item in results])
+            return json.dumps(self.stats(), sort_keys=True)
+
+    def stats(self):
+        '''returns a dict of the command counts and latencies in ms, the
+           query sizes and profile of self.metrics, the query cache counters
+           and the size of the index. The memory estimate walks every node
+           and item, so it costs about as much as a query for a common
+           token.'''
+        stats = self.metrics.summary()
+        trie = self.trie.stats()
+        getsizeof = sys.getsizeof
+        itemBytes = 0
+        for item in self.items.itervalues():
+            itemBytes += getsizeof(item) + getsizeof(item.__dict__) + \
+                         getsizeof(item.dataStr) + getsizeof(item.id) + \
+                         getsizeof(item.rank)
+        stats.update({'cache': self.cache.stats(), 'items': len(self.items),
+                      'generation': self.generation, 'trie': trie,
+                      'memoryBytes': {'trie': trie.pop('bytes'),
+                                      'items': itemBytes}})
+        return stats
+
+    def saveSnapshot(self, path):
+        '''writes the index to a snapshot file, see SnapshotReader'''
+        writeSnapshot(self, path)
+
+    def loadSnapshot(self, path):
+        '''replaces the index with the one in a snapshot file. The file is
+           memory mapped and its trie nodes are decoded as they are used'''
+        reader = SnapshotReader(path)
+        self.ordinals = reader.items()
+        self.items = dict([(item.id, item) for item in self.ordinals
+                           if item is not None])
+        self.freeOrdinals = [ordinal for (ordinal, item)
+                             in enumerate(self.ordinals) if item is None]
+        if self.columns is not None:
+            self.columns = ColumnStore.fromItems(self.ordinals)
+        self.trie = Trie()
+        self.trie.root = reader.root()
+        self.inserted = reader.inserted
+        self.generation = max(self.generation, reader.generation) + 1
+        self.cache = QueryCache(self.cache.capacity)
+        for standing in self.standing.itervalues():
+            standing.stale()
+
+    def _query(self, boosts, numOfResults, queryTokens):
+        '''returns the ids of the items that match the words in the query
+           string, upto a certain number -- numOfResult, going through the
+           query cache, under the profiler of self.metrics if it samples the
+           query'''
+        profiler = self.metrics.sample()
+        if profiler is not None:
+            return profiler.runcall(self._cachedQuery, boosts, numOfResults,
+                                    queryTokens)
+        return self._cachedQuery(boosts, numOfResults, queryTokens)
+
+    def _cachedQuery(self, boosts, numOfResults, queryTokens):
+        key = self.cache.key(boosts, numOfResults, queryTokens)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._evaluate(boosts, numOfResults, queryTokens)
+            self.cache.put(key, result)
+        return result
+
+############################################################################
+##############################Snapshots#####################################
+SNAPSHOT_MAGIC = 'QSNP'
+SNAPSHOT_VERSION = 1
+#magic, version, byte order, crc32 of everything after it, root node offset,
+#items offset, next insertionID, generation
+SNAPSHOT_HEADER = struct.Struct('<4sIB3xIQQqq')
+_CRC_START = 16
 
+def writeSnapshot(handler, path):
+    '''Writes the items, the trie and its posting lists of a MainHandler
+       to path, through a temporary file that replaces path once complete.
+
+       All offsets in the file are absolute. The items are stored column
+       by column. The nodes are written children first, so that every node
+       record can hold the offsets of its children:
+         node: label length (H), label, postings offset (Q),
+               child count (I), child offsets (Q each)
+         postings: type count (H), then per type: type length (B), type,
+                   item count (I), item ordinals in rank order (I each);
+                   container count (I), then per container: high bits (I),
+                   kind (B, 0 for an array and 1 for full), count (I),
+                   the array('H') or the 8192 byte bitmap
+    '''
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, 0, 0, 0, 0, 0, 0)]
+    offset = [SNAPSHOT_HEADER.size]
+
+    def write(data):
+        start = offset[0]
+        parts.append(data)
+        offset[0] += len(data)
+        return start
+
+    def writePostings(postings):
+        record = [struct.pack('<H', len(postings.typed))]
+        for type_ in sorted(postings.typed):
+            ordinals = [rank[2].ordinal for rank in postings.typed[type_]]
+            record += [struct.pack('<B', len(type_)), type_,
+                       struct.pack('<I', len(ordinals)),
+                       struct.pack('<%dI' % len(ordinals), *ordinals)]
+        containers = postings.bitmap.containers
+        record.append(struct.pack('<I', len(containers)))
+        for high in sorted(containers):
+            container = containers[high]
+            if type(container) is list:
+                record += [struct.pack('<IBI', high, 1, container[1]),
+                           str(container[0])]
+            else:
+                record += [struct.pack('<IBI', high, 0, len(container)),
+                           container.tostring()]
+        return write("".join(record))
+
+    def writeNode(node):
+        childOffsets = [writeNode(child) for child in node.iterChildren()]
+        postingsOffset = writePostings(node.items)
+        return write(struct.pack('<H', len(node.label)) + node.label +
+                     struct.pack('<QI', postingsOffset, len(childOffsets)) +
+                     struct.pack('<%dQ' % len(childOffsets), *childOffsets))
+
+    ordinals = handler.ordinals
+    present = bytearray([item is not None for item in ordinals])
+    live = [item for item in ordinals if item is not None]
+    text = "\n".join(["%s\n%s\n%s" % (item.type, item.id, item.dataStr)
+                      for item in live])
+    itemsOffset = write(struct.pack('<Q', len(ordinals)) + str(present) +
+                        struct.pack('<%dd' % len(live),
+                                    *[item.score for item in live]) +
+                        struct.pack('<%dq' % len(live),
+                                    *[item.insertionID for item in live]) +
+                        struct.pack('<Q', len(text)) + text)
+    rootOffset = writeNode(handler.trie.root)
+
+    body = "".join(parts)
+    byteOrder = 1 if sys.byteorder == 'little' else 0
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, byteOrder,
+                                  0, rootOffset, itemsOffset,
+                                  handler.inserted, handler.generation)
+    body = header + body[SNAPSHOT_HEADER.size:]
+    crc = zlib.crc32(buffer(body, _CRC_START)) & 0xffffffff
+    body = body[:12] + struct.pack('<I', crc) + body[_CRC_START:]
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(body)
+    os.rename(tmpPath, path)
+
+class SnapshotReader(object):
+    '''Memory maps a snapshot written by writeSnapshot, after checking
+       its header and checksum, and decodes its parts on demand.
+
+       Attributes:
+         data: the mmap of the file
+         ordinals: the items of the snapshot by ordinal, once read
+         inserted, generation: the MainHandler counters at save time
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError("%s is not a search snapshot" % path)
+        (magic, version, byteOrder, crc, self.rootOffset, self.itemsOffset,
+         self.inserted, self.generation) = \
+            SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("%s is not a search snapshot" % path)
+        if version != SNAPSHOT_VERSION or \
+           byteOrder != (1 if sys.byteorder == 'little' else 0):
+            raise ValueError("%s is a snapshot of an unsupported version"
+                             % path)
+        check = 0
+        for start in xrange(_CRC_START, len(data), 1 << 20):
+            check = zlib.crc32(data[start:start + (1 << 20)], check)
+        if check & 0xffffffff != crc:
+            raise ValueError("%s is a corrupt snapshot" % path)
+        self.ordinals = None
+
+    def items(self):
+        data = self.data
+        offset = self.itemsOffset
+        (count,) = struct.unpack_from('<Q', data, offset)
+        offset += 8
+        present = bytearray(data[offset:offset + count])
+        offset += count
+        live = present.count("\x01")
+        scores = struct.unpack_from('<%dd' % live, data, offset)
+        offset += 8 * live
+        insertionIDs = struct.unpack_from('<%dq' % live, data, offset)
+        offset += 8 * live
+        (length,) = struct.unpack_from('<Q', data, offset)
+        offset += 8
+        fields = data[offset:offset + length].split("\n")
+        ordinals = [None] * count
+        i = 0
+        for (ordinal, isPresent) in enumerate(present):
+            if isPresent:
+                ordinals[ordinal] = Item(fields[3*i], fields[3*i + 1],
+                                         scores[i], fields[3*i + 2],
+                                         insertionIDs[i], ordinal)
+                i += 1
+        self.ordinals = ordinals
+        return ordinals
+
+    def root(self):
+        return LazyTrieNode(self, self.rootOffset)
+
+    def children(self, offset):
+        '''returns the keys and children of the node record at offset, in
+           the layout TrieNode uses for that many children'''
+        data = self.data
+        (count,) = struct.unpack_from('<I', data, offset)
+        offsets = struct.unpack_from('<%dQ' % count, data, offset + 4)
+        children = [LazyTrieNode(self, childOffset) for childOffset in offsets]
+        keys = "".join([child.label[0] for child in children])
+        if count > TrieNode.fanoutLimit:
+            return None, dict(zip(keys, children))
+        return keys, children
+
+    def postings(self, offset):
+        data = self.data
+        ordinals = self.ordinals
+        postings = PostingList()
+        (typeCount,) = struct.unpack_from('<H', data, offset)
+        offset += 2
+        for _ in xrange(typeCount):
+            (length,) = struct.unpack_from('<B', data, offset)
+            type_ = data[offset + 1:offset + 1 + length]
+            offset += 1 + length
+            (count,) = struct.unpack_from('<I', data, offset)
+            members = struct.unpack_from('<%dI' % count, data, offset + 4)
+            offset += 4 + 4 * count
+            postings.typed[type_] = RankedList.fromSorted(
+                [ordinals[ordinal].rank for ordinal in members])
+        bitmap = postings.bitmap
+        (containerCount,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for _ in xrange(containerCount):
+            (high, kind, count) = struct.unpack_from('<IBI', data, offset)
+            offset += 9
+            if kind:
+                bitmap.containers[high] = [bytearray(data[offset:offset + 8192]),
+                                           count, None]
+                offset += 8192
+            else:
+                container = array('H')
+                container.fromstring(data[offset:offset + 2 * count])
+                bitmap.containers[high] = container
+                offset += 2 * count
+            bitmap.size += count
+        return postings
+
+class LazyTrieNode(TrieNode):
+    '''A TrieNode of a snapshot, whose label is read up front and whose
+       children and items are decoded the first time they are used.'''
+    __slots__ = ('reader', 'offset', '_keys', '_children', '_items')
+
+    def __init__(self, reader, offset):
+        data = reader.data
+        (length,) = struct.unpack_from('<H', data, offset)
+        self.label = data[offset + 2:offset + 2 + length]
+        self.reader = reader
+        self.offset = offset + 2 + length
+        self._keys = None
+        self._children = None
+        self._items = None
+
+    def _loadChildren(self):
+        self._keys, self._children = self.reader.children(self.offset + 8)
+
+    def _getKeys(self):
+        if self._children is None:
+            self._loadChildren()
+        return self._keys
+
+    def _setKeys(self, keys):
+        if self._children is None:
+            self._loadChildren()
+        self._keys = keys
+
+    def _getChildren(self):
+        if self._children is None:
+            self._loadChildren()
+        return self._children
+
+    def _setChildren(self, children):
+        if self._children is None:
+            self._loadChildren()
+        self._children = children
+
+    def _getItems(self):
+        if self._items is None:
+            (postingsOffset,) = struct.unpack_from('<Q', self.reader.data,
+                                                   self.offset)
+            self._items = self.reader.postings(postingsOffset)
+        return self._items
+
+    def _setItems(self, items):
+        self._items = items
+
+    keys = property(_getKeys, _setKeys)
+    children = property(_getChildren, _setChildren)
+    items = property(_getItems, _setItems)
+
+class ResultWriter(object):
+    '''Buffers result lines and writes them out in a single call once
+       flushEvery of them have piled up, or when flush is called.
+    '''
+    def __init__(self, outfile, flushEvery=256):
+        self.outfile = outfile
+        self.flushEvery = flushEvery
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.flushEvery:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.lines.append("")
+            self.outfile.write("\n".join(self.lines))
+            self.lines = []
+        self.outfile.flush()
+
+def inputPending(infile):
+    '''returns False only when the infile is known to have nothing to read
+       right away, e.g. a pipe whose writer has not sent the next line'''
+    try:
+        return bool(select.select([infile], [], [], 0)[0])
+    except (AttributeError, TypeError, ValueError, select.error):
+        #not backed by a file descriptor, so reading never blocks
+        return True
+
+def serve(infile, outfile, flushEvery=256, flushOnIdle=True, Main=None):
+    '''reads the commands from the infile one line at a time, as they
+       arrive, and writes the results to the outfile through a
+       ResultWriter. With flushOnIdle the results are also flushed whenever
+       the next command has not arrived yet, so a client that waits for
+       its answers before sending more is never left hanging.
+
+       Runs of QUERY and WQUERY lines are held back until flushEvery of
+       them have arrived, another command arrives or the input runs dry,
+       and are then evaluated together by MainHandler.executeQueries.
+    '''
+    if Main is None:
+        Main = MainHandler()
+    writer = ResultWriter(outfile, flushEvery)
+    readline = infile.readline
+    queries = []
+    N = int(readline())
+    for _ in xrange(N):
+        if queries or (flushOnIdle and writer.lines):
+            idle = not inputPending(infile)
+            if queries and (idle or len(queries) >= flushEvery):
+                for result in Main.executeQueries(queries):
+                    writer.write(result)
+                queries = []
+            if flushOnIdle and idle and writer.lines:
+                writer.flush()
+        line = readline()
+        if not line:
+            break
+        if Main.isQuery(line):
+            queries.append(line)
+            continue
+        if queries:
+            for result in Main.executeQueries(queries):
+                writer.write(result)
+            queries = []
+        result = Main.execute(line)
+        if result is not None:
+            writer.write(result)
+    if queries:
+        for result in Main.executeQueries(queries):
+            writer.write(result)
+    writer.flush()
 
 def main():
-    lines = raw_input().split('\n')
-    #lines = inputt.split('\n')
-    N = int(lines[0])
     Main = MainHandler()
-    add = Main.add
-    delete = Main.delete
-    query = Main.query
-    wquery = Main.wquery
-    inserted = 0
-    for line in lines[1:N+1]:
-        [command, commandData] = line.strip().split(" ", 1)
-
-        if command == 'ADD':
-            add(commandData,inserted)
-            inserted += 1
-        elif command == 'DEL':
-            delete(commandData)
-        elif command == 'QUERY':
-            query(commandData)
-        elif command == 'WQUERY':
-            wquery(commandData)
+    #search.py [snapshot] starts from the index saved in the snapshot
+    if len(sys.argv) > 1:
+        Main.loadSnapshot(sys.argv[1])
+    serve(sys.stdin, sys.stdout, Main=Main)
 
 if __name__ == '__main__':
     main()
@@ -285,8 +2660,4 @@ def make_input():
         
     return inputt
 
-##x=make_input()
-##s = time.time()
-##main(x)
-##e = time.time()
-##print '%d' % (e-s)
+#benchmark.py times the engines on seeded workloads
@@ -0,0 +1,371 @@
+import os
+import sys
+import stat
+import time
+import errno
+import random
+import socket
+import asyncore
+from collections import deque
+
+from search import MainHandler
+from benchmark import percentile, storyQueries
+
+def parseAddress(address):
+    '''returns the socket family and address of host:port for TCP, and of
+       anything else as the path of a Unix socket'''
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+class Connection(asyncore.dispatcher):
+    '''A client of a Server.
+
+       The command lines are queued as they arrive and run by the server
+       in order, and the results are queued in the same order, so a client
+       can pipeline as many commands as it likes. All the results a turn of
+       the server produces for the connection go out in a single send.
+
+       Attributes:
+         server: the Server the client connected to
+         partial: what came after the last newline received
+         lines: deque of the command lines received but not run yet, and
+         None in place of a line that was longer than maxLineLength
+         out: the results not sent yet
+         eof: set once the client has sent everything it is going to
+         tooLong: set once the client sent a line longer than
+         maxLineLength, after which whatever it sends is dropped
+         shutDown: set once the ERROR line of tooLong has been sent and the
+         sending side of the socket shut down
+    '''
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self.partial = ""
+        self.lines = deque()
+        self.out = ""
+        self.eof = False
+        self.tooLong = False
+        self.shutDown = False
+
+    def readable(self):
+        #a client that does not read its results, or sends faster than it
+        #is served, is not read from until it catches up, so that the socket
+        #buffers fill up and hold it back
+        if self.tooLong:
+            return not self.eof
+        return not self.eof and len(self.out) < self.server.maxOutput and \
+               len(self.lines) < self.server.maxLines
+
+    def writable(self):
+        return bool(self.out)
+
+    def handle_read(self):
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return
+            self.handle_close()
+            return
+        if not data:
+            self.eof = True
+            if self.partial and not self.tooLong:
+                self.lines.append(self.partial)
+                self.partial = ""
+            self.closeIfDone()
+            return
+        if self.tooLong:
+            return
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        self.lines.extend(lines)
+        if len(self.partial) > self.server.maxLineLength:
+            #the rest of the line is never kept, so neither it nor anything
+            #after it can be answered
+            self.partial = ""
+            self.lines.append(None)
+            self.tooLong = True
+
+    def handle_write(self):
+        try:
+            sent = self.socket.send(self.out)
+        except socket.error as e:
+            if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return
+            self.handle_close()
+            return
+        self.out = self.out[sent:]
+        self.closeIfDone()
+
+    def closeIfDone(self):
+        if self.lines or self.out:
+            return
+        if self.eof:
+            self.handle_close()
+        elif self.tooLong and not self.shutDown:
+            #closing with input left unread would reset the connection and
+            #could lose the ERROR line, so the client is told there is
+            #nothing more to read and the connection closes once it stops
+            #sending
+            self.shutDown = True
+            try:
+                self.socket.shutdown(socket.SHUT_WR)
+            except socket.error:
+                self.handle_close()
+
+    def handle_close(self):
+        self.server.connections.discard(self)
+        self.close()
+
+class Server(asyncore.dispatcher):
+    '''Serves the commands of MainHandler.execute to any number of clients,
+       over TCP or a Unix socket, one command per line.
+
+       Unlike the input of serve, there is no count of commands up front:
+       a client sends lines for as long as it is connected, and gets
+       exactly one line back for every command, in order: the result line
+       of a command that has one, such as QUERY and WQUERY, OK for one that
+       does not, such as ADD and DEL, and an ERROR line for one that fails.
+       So the n-th line back always answers the n-th command. Blank lines
+       are not commands and get nothing back.
+
+       Every turn of the loop reads whatever the clients have sent, then
+       runs up to linesPerTurn lines of every client with lines waiting,
+       so a client sending a long pipeline does not hold up the others, and
+       then sends the results of the turn.
+
+       Only the commands in self.commands are run. SNAPSHOT reads and
+       writes files on the server's machine, at any path it is given, so it
+       is left to whoever starts the server, see main. So are STATS PROFILE
+       and STATS RESET, which change what every client sees in STATS, while
+       STATS on its own is served. Every standing query is checked on every
+       write, so clients may only keep up to maxStanding of them between
+       them; replacing one that exists is always allowed.
+
+       Attributes:
+         map: the asyncore socket map of the server and its connections
+         Main: the MainHandler that runs the commands
+         connections: the open Connections
+         maxOutput: the bytes of results waiting to be sent, past which a
+         connection is neither read from nor served
+         maxLines: the lines waiting to be run, past which a connection is
+         not read from
+         maxLineLength: the longest line a client may send; a longer one
+         gets an ERROR line and the connection is closed
+         linesPerTurn: the most lines of a connection run per turn
+         maxStanding: the most standing queries clients may add
+         commands: the commands a client may send
+    '''
+    maxOutput = 1 << 20
+    maxLines = 4096
+    maxLineLength = 1 << 16
+    linesPerTurn = 256
+    maxStanding = 64
+    commands = frozenset(['ADD', 'DEL', 'UPDATE', 'QUERY', 'WQUERY', 'STATS',
+                          'STANDING', 'PAGE'])
+
+    def __init__(self, address, Main=None):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        family, address = parseAddress(address)
+        if family == socket.AF_UNIX and os.path.exists(address) and \
+           stat.S_ISSOCK(os.stat(address).st_mode):
+            #left behind by a server that did not shut down cleanly
+            os.unlink(address)
+        self.create_socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+        if Main is None:
+            Main = MainHandler()
+        self.Main = Main
+        self.connections = set()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.connections.add(Connection(pair[0], self))
+
+    def runTurn(self):
+        '''runs the lines waiting on every connection, upto linesPerTurn of
+           each, and queues their results to be sent. The runs of QUERY and
+           WQUERY lines of a connection are evaluated together'''
+        for conn in list(self.connections):
+            lines = conn.lines
+            results = []
+            queries = []
+            while lines and len(results) + len(queries) < self.linesPerTurn \
+                  and len(conn.out) < self.maxOutput:
+                line = lines.popleft()
+                if line is None:
+                    if queries:
+                        results.extend(self.runQueries(queries))
+                        queries = []
+                    results.append("ERROR line too long")
+                    lines.clear()
+                    break
+                if not line.strip():
+                    continue
+                if self.Main.isQuery(line):
+                    queries.append(line)
+                    continue
+                if queries:
+                    results.extend(self.runQueries(queries))
+                    queries = []
+                results.append(self.runLine(line))
+            if queries:
+                results.extend(self.runQueries(queries))
+            if results:
+                results.append("")
+                conn.out += "\n".join(results)
+            conn.closeIfDone()
+
+    def runLine(self, line):
+        '''returns the reply line of a command line'''
+        words = line.split()
+        command = words[0]
+        if command not in self.commands:
+            return "ERROR %s is not served" % command
+        if command == 'STATS' and len(words) > 1:
+            return "ERROR STATS %s is not served" % words[1]
+        try:
+            if command == 'STANDING' and words[1:2] == ['ADD'] and \
+               len(words) > 2 and words[2] not in self.Main.standing and \
+               len(self.Main.standing) >= self.maxStanding:
+                return "ERROR there are %d standing queries already" % \
+                       self.maxStanding
+            result = self.Main.execute(line)
+        except Exception as e:
+            return "ERROR %s" % e
+        return "OK" if result is None else result
+
+    def runQueries(self, lines):
+        try:
+            return self.Main.executeQueries(lines)
+        except Exception:
+            #queries write nothing, so they can be run again one at a time
+            #to find out which of them failed
+            return [self.runLine(line) for line in lines]
+
+    def serveForever(self, timeout=1.0):
+        while True:
+            #poll without waiting while there are lines left to run
+            waiting = [conn for conn in self.connections
+                       if conn.lines and len(conn.out) < self.maxOutput]
+            asyncore.loop(0 if waiting else timeout, False, self.map, 1)
+            self.runTurn()
+
+class LoadConnection(asyncore.dispatcher):
+    '''A connection of loadTest, which keeps up to depth queries in flight
+       and records the time each one took to come back.'''
+    def __init__(self, address, queries, depth, latencies, map):
+        asyncore.dispatcher.__init__(self, map=map)
+        family, address = parseAddress(address)
+        self.create_socket(family, socket.SOCK_STREAM)
+        self.connect(address)
+        self.queries = queries
+        self.next = random.randrange(len(queries))
+        self.depth = depth
+        self.latencies = latencies
+        self.sentAt = deque()
+        self.out = ""
+        self.partial = ""
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return len(self.sentAt) < self.depth or bool(self.out)
+
+    def handle_write(self):
+        lines = []
+        now = time.time()
+        while len(self.sentAt) < self.depth:
+            lines.append(self.queries[self.next])
+            self.next = (self.next + 1) % len(self.queries)
+            self.sentAt.append(now)
+        if lines:
+            lines.append("")
+            self.out += "\n".join(lines)
+        self.out = self.out[self.send(self.out):]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        now = time.time()
+        for _ in lines:
+            self.latencies.append(now - self.sentAt.popleft())
+
+def sendAll(address, lines):
+    '''sends command lines over a single connection, returning their reply
+       lines once the server has run them all'''
+    family, address = parseAddress(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    lines = [line for line in lines if line.strip()]
+    sock.sendall("\n".join(lines + ['']))
+    reply = ""
+    while reply.count("\n") < len(lines):
+        data = sock.recv(65536)
+        if not data:
+            break
+        reply += data
+    sock.close()
+    return reply.split("\n")[:-1]
+
+def loadTest(address, queries, connections=8, depth=16, duration=10.0):
+    '''sends the queries from a number of connections that keep depth of
+       them in flight for duration seconds, and returns the queries per
+       second along with the p50 and p99 latencies in seconds'''
+    map = {}
+    latencies = []
+    clients = [LoadConnection(address, queries, depth, latencies, map)
+               for _ in range(connections)]
+    start = time.time()
+    while time.time() - start < duration:
+        asyncore.loop(0.1, False, map, 1)
+    elapsed = time.time() - start
+    for client in clients:
+        client.close()
+    latencies.sort()
+    return (len(latencies) / elapsed, percentile(latencies, 0.5),
+            percentile(latencies, 0.99))
+
+############################################################################
+##############################Test Time#####################################
+def main():
+    '''search_server.py serve <host:port | socket path> [snapshot]
+       search_server.py load <host:port | socket path>
+                             [connections] [depth] [seconds]
+
+       load ADDs the make_input items, then reports the throughput and
+       latency of QUERYs for their words.'''
+    if len(sys.argv) < 3 or sys.argv[1] not in ('serve', 'load'):
+        print main.__doc__
+        return
+    address = sys.argv[2]
+    if sys.argv[1] == 'serve':
+        Main = MainHandler()
+        if len(sys.argv) > 3:
+            Main.loadSnapshot(sys.argv[3])
+        Server(address, Main).serveForever()
+        return
+    connections, depth, duration = 8, 16, 10.0
+    if len(sys.argv) > 3:
+        connections = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        depth = int(sys.argv[4])
+    if len(sys.argv) > 5:
+        duration = float(sys.argv[5])
+    adds, queries = storyQueries()
+    sendAll(address, adds)
+    rps, p50, p99 = loadTest(address, queries, connections, depth, duration)
+    print '%d connections, depth %d: %.0f queries/s, p50 %.2fms, ' \
+          'p99 %.2fms' % (connections, depth, rps, p50 * 1000, p99 * 1000)
+
+if __name__ == '__main__':
+    main()
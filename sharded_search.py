@@ -0,0 +1,230 @@
+import time
+import zlib
+import heapq
+from itertools import islice
+from multiprocessing import Process, Pipe
+
+from search import MainHandler
+from benchmark import storyQueries
+
+def shardOf(itemID, numOfShards):
+    '''the shard that owns an item; crc32 is the same in every process,
+       unlike the hash of a string'''
+    return (zlib.crc32(itemID) & 0xffffffff) % numOfShards
+
+def work(conn):
+    '''the loop of a worker process, which owns one MainHandler and runs
+       the messages of the coordinator in the order they arrive'''
+    #TOP asks for ranks, which the query cache does not keep, so a cache
+    #would only ever be invalidated
+    Main = MainHandler(cacheSize=0)
+    while True:
+        message = conn.recv()
+        command = message[0]
+        if command == 'CLOSE':
+            break
+        try:
+            if command == 'ADD':
+                Main.add(message[1], message[2])
+            elif command == 'DEL':
+                Main.delete(message[1])
+            elif command == 'UPDATE':
+                Main.update(message[1])
+            elif command == 'TOP':
+                ranks = Main._topRanks(message[1], message[2], message[3])
+                conn.send([(score, insertionID, item.id)
+                           for (score, insertionID, item) in ranks])
+        except Exception as e:
+            #a write that fails leaves the shard as it was, as it would a
+            #MainHandler, but the coordinator does not wait for writes, so
+            #only a failed TOP is answered, with the error in place of the
+            #ranks
+            if command == 'TOP':
+                conn.send(('ERROR', '%s: %s' % (type(e).__name__, e)))
+    conn.close()
+
+class ShardedHandler(object):
+    '''Handles the commands passed in as input with the items spread over
+       worker processes, each with its own MainHandler.
+
+       ADD, DEL and UPDATE go only to the shard that owns the item's id, while
+       QUERY and WQUERY go to every shard. Each shard answers with its own
+       top results as (boosted score, insertionID, id) tuples, which are
+       merged with the same tie-breaking as Item.__cmp__. The insertionIDs
+       are handed out here, so they are the same as with a single
+       MainHandler.
+
+       A pipe delivers the messages of a worker in order, so a query sent
+       after an ADD always sees it, and commands can be pipelined: see
+       executeAll. isQuery and executeQueries are those of MainHandler too,
+       so serve and Server can run a ShardedHandler in its place.
+
+       A worker survives a command that fails. Writes are not answered, so
+       a failed ADD, DEL or UPDATE is dropped without a word, while a
+       failed query raises RuntimeError from _gatherQuery.
+
+       Attributes:
+         conns: the coordinator's ends of the pipes to the workers
+         workers: the worker processes
+         inserted: the insertionID of the next item ADDed through execute
+    '''
+    def __init__(self, numOfShards):
+        self.conns = []
+        self.workers = []
+        for _ in range(numOfShards):
+            conn, workerConn = Pipe()
+            worker = Process(target=work, args=(workerConn,))
+            worker.daemon = True
+            worker.start()
+            workerConn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.inserted = 0
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('CLOSE',))
+        for worker in self.workers:
+            worker.join()
+
+    def add(self, commandData, insertionID):
+        '''ADD <type> <id> <score> <data string that contain spaces>'''
+        itemID = commandData.split(" ", 2)[1]
+        conn = self.conns[shardOf(itemID, len(self.conns))]
+        conn.send(('ADD', commandData, insertionID))
+
+    def delete(self, commandData):
+        '''DEL <id>'''
+        conn = self.conns[shardOf(commandData, len(self.conns))]
+        conn.send(('DEL', commandData))
+
+    def update(self, commandData):
+        '''UPDATE <id> <score>'''
+        itemID = commandData.split(" ", 1)[0]
+        conn = self.conns[shardOf(itemID, len(self.conns))]
+        conn.send(('UPDATE', commandData))
+
+    def query(self, commandData):
+        '''QUERY <number of results> <query string that can contain spaces>'''
+        print self._query(*MainHandler.parseQuery(commandData))
+
+    def wquery(self, commandData):
+        '''WQUERY <number of results> <number of boosts>
+                  (<type>:<boost>)* (<id>:<boost>)*
+                  <query string that can contain spaces>'''
+        print self._query(*MainHandler.parseWquery(commandData))
+
+    def _query(self, boosts, numOfResults, queryTokens):
+        self._sendQuery(boosts, numOfResults, queryTokens)
+        return self._gatherQuery(numOfResults)
+
+    def _sendQuery(self, boosts, numOfResults, queryTokens):
+        message = ('TOP', boosts, numOfResults, queryTokens)
+        for conn in self.conns:
+            conn.send(message)
+
+    def _gatherQuery(self, numOfResults):
+        #every shard answers, even when one fails, so that the answers to
+        #the queries after it still line up
+        answers = [conn.recv() for conn in self.conns]
+        for answer in answers:
+            if type(answer) is tuple:
+                raise RuntimeError('a shard failed the query: %s' % answer[1])
+        #each shard's answer is best first, i.e. ascending once negated
+        streams = [[(-score, -insertionID, itemID)
+                    for (score, insertionID, itemID) in answer]
+                   for answer in answers]
+        results = islice(heapq.merge(*streams), max(numOfResults, 0))
+        return " ".join([itemID for (_, _, itemID) in results])
+
+    def _send(self, line):
+        '''sends a command line to the shards, returning the number of
+           results of a QUERY or WQUERY and None for the other commands'''
+        [command, commandData] = line.strip().split(" ", 1)
+
+        if command == 'ADD':
+            self.add(commandData, self.inserted)
+            self.inserted += 1
+        elif command == 'DEL':
+            self.delete(commandData)
+        elif command == 'UPDATE':
+            self.update(commandData)
+        elif command == 'QUERY':
+            args = MainHandler.parseQuery(commandData)
+            self._sendQuery(*args)
+            return args[1]
+        elif command == 'WQUERY':
+            args = MainHandler.parseWquery(commandData)
+            self._sendQuery(*args)
+            return args[1]
+
+    def execute(self, line):
+        '''runs a single command line, returning the result line of a QUERY
+           or WQUERY and None for the other commands'''
+        numOfResults = self._send(line)
+        if numOfResults is not None:
+            return self._gatherQuery(numOfResults)
+
+    isQuery = staticmethod(MainHandler.isQuery)
+
+    def executeQueries(self, lines):
+        '''returns the result lines of a run of QUERY and WQUERY lines, in
+           order, sending them all before gathering any so the shards work
+           on them in parallel. Nothing is sent unless every line parses,
+           and every answer is gathered even when a query fails, so a run
+           that raises can safely be run again.'''
+        queries = []
+        for line in lines:
+            [command, commandData] = line.strip().split(" ", 1)
+            if command == 'QUERY':
+                queries.append(MainHandler.parseQuery(commandData))
+            else:
+                queries.append(MainHandler.parseWquery(commandData))
+        for args in queries:
+            self._sendQuery(*args)
+        results = []
+        failure = None
+        for args in queries:
+            try:
+                results.append(self._gatherQuery(args[1]))
+            except RuntimeError as e:
+                failure = e
+        if failure is not None:
+            raise failure
+        return results
+
+    def executeAll(self, lines, window=64):
+        '''yields the result lines of the commands in order, keeping up to
+           window queries in flight so the shards work on them in parallel
+           and the coordinator never waits on a single one'''
+        pending = []
+        for line in lines:
+            numOfResults = self._send(line)
+            if numOfResults is not None:
+                pending.append(numOfResults)
+                if len(pending) >= window:
+                    yield self._gatherQuery(pending.pop(0))
+        for numOfResults in pending:
+            yield self._gatherQuery(numOfResults)
+
+############################################################################
+##############################Test Time#####################################
+def benchmark(shardCounts=(1, 2, 4, 8), numOfQueries=4000):
+    '''prints the query throughput of the make_input corpus for a number
+       of shards'''
+    adds, queries = storyQueries(numOfQueries)
+    for numOfShards in shardCounts:
+        Main = ShardedHandler(numOfShards)
+        for line in adds:
+            Main._send(line)
+        Main.execute('QUERY 1 a')
+        start = time.time()
+        for _ in Main.executeAll(queries):
+            pass
+        elapsed = time.time() - start
+        print '%d shards: %.0f queries/s' % (numOfShards,
+                                               numOfQueries / elapsed)
+        Main.close()
+
+if __name__ == '__main__':
+    benchmark()
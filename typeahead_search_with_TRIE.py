@@ -1,8 +1,12 @@
 import sys
 from collections import OrderedDict
 import copy
+import heapq
 import random
 import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import islice
 
 import collections
 import functools
@@ -34,15 +38,17 @@ class memoized(object):
         return functools.partial(self.__call__, obj)
 
 class Item(object):
-    def __init__(self, itemType, itemID, score, dataStr, insertion_id):
+    __slots__ = ('itemType', 'itemID', 'score', 'dataStr', 'insertion_id',
+                 'ordinal')
+
+    def __init__(self, itemType, itemID, score, dataStr, insertion_id,
+                 ordinal=None):
         self.itemType = itemType
         self.itemID = itemID
         self.score = float(score)
         self.dataStr = dataStr
-        #self.trie = Trie()
-        #for word in dataStr.lower().split(" "):
-        #self.trie.add(set(dataStr.lower().split(" ")), self)
         self.insertion_id = insertion_id
+        self.ordinal = ordinal
 
     def __repr__(self):
         info = (self.itemType, self.itemID, self.score, self.dataStr)
@@ -60,60 +66,141 @@ class Item(object):
             return -1
 
     def foundToken(self, word):
-        return self.trie.isPrefix(word)
+        for dataWord in self.dataStr.lower().split():
+            if dataWord.startswith(word):
+                return True
+        return False
+
+def rank(item):
+    '''sorts ascending in the order the results are printed in'''
+    return (-item.score, -item.insertion_id)
+
+def prefix_end(prefix):
+    '''the smallest string that sorts after every string starting with
+       prefix, or None if there is no such string'''
+    prefix = prefix.rstrip('\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def prefix_range(words, prefix):
+    '''the range of the sorted words that start with prefix'''
+    end = prefix_end(prefix)
+    hi = len(words) if end is None else bisect_left(words, end)
+    return bisect_left(words, prefix), hi
+
+def distinct(ordinals):
+    '''drops the repeats from an ascending stream of ordinals'''
+    last = None
+    for ordinal in ordinals:
+        if ordinal != last:
+            last = ordinal
+            yield ordinal
 
-class Trie(object):
-    def __init__(self):
-        self.root = {}
-        self.items = {}
-
-    def __repr__(self):
-        return self.root
-    
-    def add(self, word, item):
-        curr_vertex = self.root
-        for i,ltr in enumerate(word):
-            #print curr_vertex, ltr
-            try:
-                curr_vertex = curr_vertex[ltr][0]
-            except KeyError:    
-##                    if i == len(word) - 1:
-##                        curr_vertex[ltr] = curr_vertex.get(ltr, []) + [item]
-##                    else:
-                curr_vertex[ltr] = [{}]
-                #print curr_vertex,'\n\n'   
-                curr_vertex = curr_vertex[ltr][0]
-                    
-    def isPrefix(self, word):
-        curr_node = self.root
-        for ltr in word:
-            branch = curr_node.get(ltr, None)
-            if branch is None:
-                return False
-            else:
-                curr_node = branch[0]
-        return True
-        
 class OrdDict(object):
+    '''An inverted index over a sorted array of the distinct words of the
+       items, for a much smaller index than the trie of search.py, which
+       has a node per character of the words.
+
+       The main segment keeps the words in a sorted list, and the ordinals
+       of the items that have each word in a parallel list of ascending
+       array('I')s. The words that start with a query token are then a
+       contiguous range of the list, found by bisecting, and the arrays in
+       the range are merged lazily rather than unioned into a set. The
+       items of the main segment are numbered by their rank, so the merged
+       ordinals come out best first and a QUERY stops after its first
+       numOfResults matches. Of several query tokens, the one with the
+       fewest ordinals in its range is walked, and the items it yields are
+       checked for the others.
+
+       ADDs go to a small delta segment that maps the words of the new
+       items to their ordinals, kept in rank order too, so the matches of
+       both segments merge into a single stream. A DEL blanks the item's
+       slot in ordinals, leaving its ordinal in the postings to be
+       skipped. Once the ADDs and DELs since the last merge outnumber a
+       1/merge_ratio share of the items, the live items are renumbered and
+       the main segment is rebuilt with the delta merged in.
+
+       Attributes:
+         items: maps the id of an item to the Item
+         ordinals: ordinal -> Item, with None in the slots of deleted items
+         words: the sorted distinct words of the main segment
+         postings: the ordinals of the items with each word of words
+         offsets: offsets[i] is the number of ordinals in postings[:i], so
+         the size of any range of words is a subtraction
+         main_size: the number of ordinals of the main segment; the ADDed
+         items get the ordinals after them
+         delta: maps the words of the items ADDed since the last merge to
+         sorted lists of the (-score, -insertionID, ordinal) of the items
+         delta_words: the sorted words of delta
+         changes: the number of ADDs and DELs since the last merge
+    '''
+    merge_ratio = 4
+    min_delta = 1024
+
     def __init__(self):
-        self.words = Trie()
         self.items = {}
+        self.ordinals = []
+        self.words = []
+        self.postings = []
+        self.offsets = array('L', [0])
+        self.main_size = 0
+        self.delta = {}
+        self.delta_words = []
+        self.changes = 0
 
-    def add(self, words, item):
-        for word in words:
-            #self.words.add(word, item)
-            pass
-        
     def add_command(self, commandData, insertionID):
         [itemType,itemID,score,dataStr] = commandData.split(" ",3)
-        item = Item(itemType,itemID,score,dataStr,insertionID)
+        ordinal = len(self.ordinals)
+        item = Item(itemType,itemID,score,dataStr,insertionID,ordinal)
         self.items[itemID] = item
-
-        self.add(set(dataStr.lower().split(" ")), item)
+        self.ordinals.append(item)
+        for word in set(dataStr.lower().split()):
+            ordinals = self.delta.get(word)
+            if ordinals is None:
+                ordinals = self.delta[word] = []
+                insort(self.delta_words, word)
+            insort(ordinals, (-item.score, -insertionID, ordinal))
+        self.changed()
         
     def delete_command(self, command_data):
         itemID = command_data
-        self.items.pop(itemID, None)
+        item = self.items.pop(itemID, None)
+        if item is not None:
+            self.ordinals[item.ordinal] = None
+            self.changed()
+
+    def changed(self):
+        self.changes += 1
+        if self.changes > max(self.min_delta,
+                              self.main_size // self.merge_ratio):
+            self.merge()
+
+    def merge(self):
+        '''renumbers the live items by rank and rebuilds the main segment
+           from their words, emptying the delta segment'''
+        live = [item for item in self.ordinals if item is not None]
+        live.sort(key=rank)
+        postings = {}
+        for (ordinal, item) in enumerate(live):
+            item.ordinal = ordinal
+            for word in set(item.dataStr.lower().split()):
+                try:
+                    postings[word].append(ordinal)
+                except KeyError:
+                    postings[word] = array('I', [ordinal])
+        self.ordinals = live
+        self.words = sorted(postings)
+        self.postings = [postings[word] for word in self.words]
+        self.offsets = array('L', [0])
+        total = 0
+        for ordinals in self.postings:
+            total += len(ordinals)
+            self.offsets.append(total)
+        self.main_size = len(live)
+        self.delta = {}
+        self.delta_words = []
+        self.changes = 0
         
     def query_command(self, command_data):
         #print 'Beginning to query......',command_data
@@ -130,13 +217,11 @@ class OrdDict(object):
         numOfBoosts = int(numOfBoosts)
         rest_of_query = rest_of_query.split(" ", numOfBoosts)
 
+        #a type or id that is boosted more than once gets the product
         boosts = {}
         for i in range(numOfBoosts):
             [affected,boost] = rest_of_query[i].split(":")
-            try:
-                boosts[affected] += [float(boost)]
-            except KeyError:
-                boosts[affected] = [float(boost)]
+            boosts[affected] = boosts.get(affected, 1.0) * float(boost)
                                                           
         queryStr = rest_of_query[-1]
         queryTokens = queryStr.lower().split(" ")
@@ -144,48 +229,101 @@ class OrdDict(object):
         self.query(boosts, numOfResults, queryTokens)
 
     def query(self, boosts, numOfResults, queryTokens):
-        results = []
-        results_found = 0
+        results = self.top(boosts, numOfResults, queryTokens)
+        print " ".join([item.itemID for item in results])
+
+    def top(self, boosts, numOfResults, queryTokens):
+        '''returns the items that match the words in the query string,
+           best first, upto a certain number -- numOfResult'''
+        numOfResults = max(numOfResults, 0)
+        tokens = sorted(set(queryTokens))
+        if not tokens or not tokens[0] or not numOfResults:
+            #an empty token, left by a doubled space, matches no item
+            return []
+        #a token that another token starts with matches all of its items
+        tokens = [token for (i, token) in enumerate(tokens)
+                  if i + 1 == len(tokens) or
+                  not tokens[i + 1].startswith(token)]
+        ranges = [prefix_range(self.words, token) for token in tokens]
+        sizes = [self.offsets[hi] - self.offsets[lo] for (lo, hi) in ranges]
+        driver = sizes.index(min(sizes))
+        (lo, hi) = ranges[driver]
+        others = tokens[:driver] + tokens[driver + 1:]
+        ordinals = self.ordinals
+
+        def matches(stream):
+            for ordinal in stream:
+                item = ordinals[ordinal]
+                if item is None:
+                    continue
+                for token in others:
+                    if not item.foundToken(token):
+                        break
+                else:
+                    yield item
+
+        main = matches(distinct(heapq.merge(*self.postings[lo:hi])))
+        (lo, hi) = prefix_range(self.delta_words, tokens[driver])
+        if lo == hi:
+            ranked = main
+        else:
+            added = distinct(heapq.merge(*[self.delta[word] for word
+                                           in self.delta_words[lo:hi]]))
+            delta = matches(entry[2] for entry in added)
+            #both segments yield their matches best first
+            ranked = (item for (_, item) in
+                      heapq.merge(((rank(item), item) for item in main),
+                                  ((rank(item), item) for item in delta)))
 
-        types = ['user','topic','question','board']
+        if not boosts:
+            return list(islice(ranked, numOfResults))
 
-        deep_copy = copy.deepcopy
-
-        for key in self.items:
-            value = self.items[key]
-
-            if boosts:
-                for b_key in boosts.keys():
-                    for boost in boosts[b_key]:
-                        if b_key in types:
-                            if value.itemType == b_key:
-                                value = deep_copy(value)
-                                value.score *= boost
-                        else: #an id is specified
-                            value = deep_copy(self.items[b_key])
-                            value.score *= boost
-
-            noneUnfound = False
-            for token in queryTokens:
-                if not value.foundToken(token):
-                    noneUnfound = True
-            if not noneUnfound:
-                results += [value]
-                results_found += 1
-        
-        results.sort()
-        results = results[:numOfResults]
-        if results:
-            i = iter(results)
-            _ = i.next()
-            for item in results:
-                try:
-                    if i.next():
-                        print item.itemID,
-                except StopIteration:
-                    print item.itemID
-        else:
-            print ""
+        types = ['user','topic','question','board']
+        typeBoosts = dict([(affected, boost) for (affected, boost)
+                           in boosts.iteritems() if affected in types])
+        def boosted(item):
+            score = item.score * typeBoosts.get(item.itemType, 1.0)
+            if item.itemID in boosts and item.itemID not in types:
+                score *= boosts[item.itemID]
+            return (-score, -item.insertion_id)
+        if min(typeBoosts.values() or [1.0]) <= 0:
+            #a type boost that is not positive reorders the items of its
+            #type, so every match has to be scored
+            return heapq.nsmallest(numOfResults, ranked, key=boosted)
+
+        #the id boosted items are scored on their own, and no other item
+        #scores more than its score times the largest type boost, or the
+        #smallest one for a negative score. That bound only falls as the
+        #scores do, so the walk stops once it is below the k-th best
+        #boosted score
+        maxBoost = max(typeBoosts.values() + [1.0])
+        minBoost = min(typeBoosts.values() + [1.0])
+        boostedIDs = set([affected for affected in boosts
+                          if affected not in types])
+        matched = []
+        for affected in boostedIDs:
+            item = self.items.get(affected)
+            if item is not None and \
+               all([item.foundToken(token) for token in tokens]):
+                matched.append(item)
+        #the k best boosted scores so far, the worst first
+        best = []
+        def push(item):
+            score = -boosted(item)[0]
+            if len(best) < numOfResults:
+                heapq.heappush(best, score)
+            else:
+                heapq.heappushpop(best, score)
+        for item in matched:
+            push(item)
+        for item in ranked:
+            bound = item.score * (maxBoost if item.score >= 0 else minBoost)
+            if len(best) == numOfResults and bound < best[0]:
+                break
+            if item.itemID not in boostedIDs:
+                matched.append(item)
+                push(item)
+        return heapq.nsmallest(numOfResults, matched, key=boosted)
             
 def main(inputt):
     #lines = sys.stdin.readline().split('\n')
@@ -271,10 +409,10 @@ def make_input():
     return inputt
 
 
-x=make_input()
-s = time.time()
-main(x)
-e = time.time()
-print '%d' % (e-s)
-#main()
+if __name__ == '__main__':
+    x=make_input()
+    s = time.time()
+    main(x)
+    e = time.time()
+    print '%d' % (e-s)
 
@@ -0,0 +1,277 @@
+import time
+import heapq
+import threading
+
+from search import Edit, Item, Trie, IndexReader, MainHandler
+from benchmark import percentile, storyQueries
+
+class ItemMap(object):
+    '''The items of an IndexVersion by their id. The ids are spread over
+       bucketCount dicts by their hash, so a write copies the list of
+       buckets and the buckets it changes instead of a dict of every item.
+
+       Attributes:
+         buckets: the dicts from id to item, by hash of the id
+    '''
+    bucketCount = 256
+
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = [{} for _ in xrange(self.bucketCount)]
+        self.buckets = buckets
+
+    def __len__(self):
+        return sum([len(bucket) for bucket in self.buckets])
+
+    def get(self, id_, default=None):
+        return self.buckets[hash(id_) % self.bucketCount].get(id_, default)
+
+    def itervalues(self):
+        for bucket in self.buckets:
+            for item in bucket.itervalues():
+                yield item
+
+    def shallowCopy(self):
+        return ItemMap(list(self.buckets))
+
+    def put(self, item, edit):
+        i = hash(item.id) % self.bucketCount
+        bucket = self.buckets[i] = edit.writable(self.buckets[i], dict)
+        bucket[item.id] = item
+
+    def pop(self, id_, edit):
+        i = hash(id_) % self.bucketCount
+        bucket = self.buckets[i] = edit.writable(self.buckets[i], dict)
+        return bucket.pop(id_)
+
+class IndexVersion(IndexReader):
+    '''One version of the index, which never changes once it is published
+       and can be queried by any number of threads at once.
+
+       Attributes:
+         trie: the Trie of the version
+         items: the ItemMap of the version
+         generation: the number of writes before the version
+    '''
+    def __init__(self, trie, items, generation):
+        self.trie = trie
+        self.items = items
+        self.generation = generation
+
+class VersionedHandler(object):
+    '''Handles the commands passed in as input from many threads at once,
+       without ever making a query wait for a write.
+
+       Queries run against the IndexVersion that is current when they
+       start, and keep using it to the end even if writes publish newer
+       ones meanwhile. A write takes the write lock, builds the next
+       version with Trie.insert, Trie.remove and Trie.rescore under an Edit
+       and
+       publishes it by replacing self.current, which is a single reference
+       assignment. The Edit copies the nodes, chunks of ranks and bitmap
+       containers that the write touches, and every other part is shared
+       with the previous version, so a write costs about as much as it
+       does in a MainHandler. Every command takes effect at a single
+       instant: a query when it reads self.current, a write when it
+       replaces it.
+
+       A version that is no longer current is freed, together with the
+       parts no newer version shares, once the last query using it lets
+       go of it.
+
+       Attributes:
+         current: the IndexVersion that new queries use
+         writeLock: held by the one write running at a time
+         freeOrdinals: heap of the free ordinals below nextOrdinal
+         nextOrdinal: the ordinal after the largest one ever used
+         inserted: the insertionID of the next item ADDed through execute
+    '''
+    def __init__(self):
+        self.current = IndexVersion(Trie(), ItemMap(), 0)
+        self.writeLock = threading.Lock()
+        self.freeOrdinals = []
+        self.nextOrdinal = 0
+        self.inserted = 0
+
+    def add(self, commandData, insertionID):
+        '''ADD <type> <id> <score> <data string that contain spaces>'''
+        self.write([('ADD', commandData, insertionID)])
+
+    def delete(self, commandData):
+        '''DEL <id>'''
+        self.write([('DEL', commandData)])
+
+    def update(self, commandData):
+        '''UPDATE <id> <score>'''
+        self.write([('UPDATE', commandData)])
+
+    def query(self, commandData):
+        '''QUERY <number of results> <query string that can contain spaces>'''
+        print self._query(*MainHandler.parseQuery(commandData))
+
+    def wquery(self, commandData):
+        '''WQUERY <number of results> <number of boosts>
+                  (<type>:<boost>)* (<id>:<boost>)*
+                  <query string that can contain spaces>'''
+        print self._query(*MainHandler.parseWquery(commandData))
+
+    def _query(self, boosts, numOfResults, queryTokens):
+        return self.current._evaluate(boosts, numOfResults, queryTokens)
+
+    def write(self, commands):
+        '''applies a burst of ('ADD', commandData, insertionID), ('DEL', id)
+           and ('UPDATE', commandData) commands as a single new version, so
+           queries see all of them or none, and the nodes they share are
+           copied once. An ADD with None for its insertionID gets the next
+           one, as with execute. An UPDATE replaces the item with a new Item
+           of the new score and the same insertionID and ordinal, so the
+           versions before it keep the old score. A DEL or UPDATE of an
+           unknown id raises KeyError and leaves the index as it was.'''
+        with self.writeLock:
+            version = self.current
+            edit = Edit()
+            trie = Trie()
+            trie.root = version.trie.root
+            trie.edit = edit
+            items = version.items.shallowCopy()
+            freeOrdinals = list(self.freeOrdinals)
+            nextOrdinal = self.nextOrdinal
+            inserted = self.inserted
+            for command in commands:
+                if command[0] == 'ADD':
+                    [type_,id_,score,dataStr] = command[1].split(" ",3)
+                    insertionID = command[2]
+                    if insertionID is None:
+                        insertionID = inserted
+                        inserted += 1
+                    if freeOrdinals:
+                        ordinal = heapq.heappop(freeOrdinals)
+                    else:
+                        ordinal = nextOrdinal
+                        nextOrdinal += 1
+                    item = Item(type_,id_,score,dataStr,insertionID,ordinal)
+                    items.put(item, edit)
+                    trie.insert(dataStr.lower().split(), item)
+                elif command[0] == 'UPDATE':
+                    [id_, score] = command[1].split()
+                    old = items.get(id_)
+                    if old is None:
+                        raise KeyError(id_)
+                    item = Item(old.type, id_, score, old.dataStr,
+                                old.insertionID, old.ordinal)
+                    items.put(item, edit)
+                    trie.rescore(old.dataStr.lower().split(), item, old.rank,
+                                 item.rank)
+                else:
+                    item = items.pop(command[1], edit)
+                    trie.remove(item.dataStr.lower().split(), item)
+                    heapq.heappush(freeOrdinals, item.ordinal)
+            trie.edit = None
+            self.freeOrdinals = freeOrdinals
+            self.nextOrdinal = nextOrdinal
+            self.inserted = inserted
+            self.current = IndexVersion(trie, items, version.generation + 1)
+
+    def execute(self, line):
+        '''runs a single command line, returning the result line of a QUERY
+           or WQUERY and None for the other commands. Any other command
+           raises ValueError.'''
+        [command, commandData] = line.strip().split(" ", 1)
+
+        if command == 'ADD':
+            self.write([('ADD', commandData, None)])
+        elif command in ('DEL', 'UPDATE'):
+            self.write([(command, commandData)])
+        elif command == 'QUERY':
+            return self._query(*MainHandler.parseQuery(commandData))
+        elif command == 'WQUERY':
+            return self._query(*MainHandler.parseWquery(commandData))
+        else:
+            raise ValueError('unknown command %r' % command)
+
+    def executeAll(self, lines):
+        '''yields the result lines of the QUERY and WQUERY commands in
+           order, applying every run of ADD, DEL and UPDATE lines between two
+           queries as one write'''
+        writes = []
+        for line in lines:
+            [command, commandData] = line.strip().split(" ", 1)
+            if command == 'ADD':
+                writes.append(('ADD', commandData, None))
+            elif command in ('DEL', 'UPDATE'):
+                writes.append((command, commandData))
+            else:
+                if writes:
+                    self.write(writes)
+                    writes = []
+                yield self.execute(line)
+        if writes:
+            self.write(writes)
+
+############################################################################
+##############################Test Time#####################################
+class LockedHandler(MainHandler):
+    '''a MainHandler behind a global lock, for benchmark to compare with'''
+    def __init__(self):
+        MainHandler.__init__(self, cacheSize=0)
+        self.lock = threading.Lock()
+
+    def write(self, commands):
+        with self.lock:
+            for command in commands:
+                if command[0] == 'ADD':
+                    self.add(command[1], command[2])
+                elif command[0] == 'UPDATE':
+                    self.update(command[1])
+                else:
+                    self.delete(command[1])
+
+    def _query(self, boosts, numOfResults, queryTokens):
+        with self.lock:
+            return self._evaluate(boosts, numOfResults, queryTokens)
+
+def benchmark(numOfQueries=2000, burstSize=500):
+    '''prints the latency of queries made while another thread keeps
+       applying bursts of ADDs and DELs, with a MainHandler behind a lock
+       and with a VersionedHandler'''
+    adds, queries = storyQueries(numOfQueries)
+    adds = [line.split(" ", 1)[1] for line in adds]
+    queries = [MainHandler.parseQuery(line.split(" ", 1)[1])
+               for line in queries]
+    half = len(adds) // 2
+    for Handler in (LockedHandler, VersionedHandler):
+        Main = Handler()
+        Main.write([('ADD', data, i) for (i, data) in enumerate(adds[:half])])
+        stop = threading.Event()
+
+        def writer():
+            #adds the second half of the items and deletes them again
+            while not stop.is_set():
+                burst = adds[half:half + burstSize]
+                Main.write([('ADD', data, half + i)
+                            for (i, data) in enumerate(burst)])
+                Main.write([('DEL', data.split(" ", 2)[1])
+                            for data in burst])
+
+        for withWrites in (False, True):
+            if withWrites:
+                thread = threading.Thread(target=writer)
+                thread.start()
+            latencies = []
+            for args in queries:
+                start = time.time()
+                Main._query(*args)
+                latencies.append(time.time() - start)
+            if withWrites:
+                stop.set()
+                thread.join()
+            latencies.sort()
+            print '%s, %s: p50 %.2fms, p99 %.2fms, max %.2fms' % (
+                Handler.__name__,
+                'write bursts' if withWrites else 'no writes',
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                max(latencies) * 1000)
+
+if __name__ == '__main__':
+    benchmark()